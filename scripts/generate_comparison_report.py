@@ -12,7 +12,7 @@ This will produce:
 - report_dir/metadata_before.json, metadata_after.json (if sidecar meta present)
 
 The script expects the snapshot JSON format produced by `POST /api/power/snapshot` or
-by `scripts/power_report.py snapshot` (which writes the server's JSON to file).
+by `scripts/power_report.py snapshot` (column-wise `{"n": N, "<field>": [...]}`; converted back to rows here).
 
 Energy estimates use either sidecar meta (.meta.json) or environment variables:
   POWER_V_SUPPLY_MV, POWER_I_ACTIVE_MA, POWER_I_UPLINK_MA, POWER_I_SLEEP_MA
@@ -30,22 +30,29 @@ def load_json(path):
     with open(path,'r') as f: return json.load(f)
 
 
+def columns_to_rows(snap):
+    fields = [k for k in snap if k != 'n']
+    return [dict(zip(fields, vals)) for vals in zip(*(snap[k] for k in fields))]
+
+
 def summarize_rows(rows):
     if not rows: return None
     n = len(rows)
-    idle = [r['idle_budget_ms'] for r in rows]
-    sleep = [r['t_sleep_ms'] for r in rows]
-    uplink = [r['t_uplink_ms'] for r in rows]
-    bytes_ = [r['uplink_bytes'] for r in rows]
+    sum_idle = sum_sleep = sum_uplink = sum_bytes = 0
+    for r in rows:
+        sum_idle += r['idle_budget_ms']
+        sum_sleep += r['t_sleep_ms']
+        sum_uplink += r['t_uplink_ms']
+        sum_bytes += r['uplink_bytes']
     return {
         'n': n,
-        'idle_avg': sum(idle)/n,
-        'sleep_avg': sum(sleep)/n,
-        'uplink_avg': sum(uplink)/n,
-        'bytes_avg': sum(bytes_)/n,
-        'idle_sum': sum(idle),
-        'sleep_sum': sum(sleep),
-        'uplink_sum': sum(uplink),
+        'idle_avg': sum_idle/n,
+        'sleep_avg': sum_sleep/n,
+        'uplink_avg': sum_uplink/n,
+        'bytes_avg': sum_bytes/n,
+        'idle_sum': sum_idle,
+        'sleep_sum': sum_sleep,
+        'uplink_sum': sum_uplink,
     }
 
 
@@ -155,6 +162,9 @@ def main():
 
     before = load_json(args.before)
     after = load_json(args.after)
+    # columnar snapshots from scripts/power_report.py
+    if isinstance(before, dict) and 'n' in before: before = columns_to_rows(before)
+    if isinstance(after, dict) and 'n' in after: after = columns_to_rows(after)
     # handle top-level wrapper if present (snapshots previously written by server snapshot include list directly)
     rows_before = before if isinstance(before, list) else before.get('rows') if isinstance(before, dict) else None
     rows_after = after if isinstance(after, list) else after.get('rows') if isinstance(after, dict) else None
@@ -6,64 +6,167 @@ Usage:
   # Snapshot server power summary for a device and write to JSON
   python scripts/power_report.py snapshot --url http://localhost:5000 --device EcoWatt-Dev-01 --out before.json
 
+  # Same, as a NumPy (4, n) counter array; compare/compare-many load it without any JSON parsing
+  python scripts/power_report.py snapshot --url http://localhost:5000 --device EcoWatt-Dev-01 --out before.npy --format npy
+
+  # Snapshot several devices at once, one <device>.json per device
+  python scripts/power_report.py snapshot-many --url http://localhost:5000 --devices Dev-01 Dev-02 --out-dir snaps
+
   # Compare two snapshots
   python scripts/power_report.py compare --before before.json --after after.json
 
+  # Summarize many snapshots side by side (e.g. a sweep of configs)
+  python scripts/power_report.py compare-many --snapshots base.json cfg1.json cfg2.json
+
 This script queries `GET /api/power/<device>` for recent entries and summarizes average idle/sleep/uplink times.
+Snapshots are stored column-wise, `{"n": N, "<field>": [values...]}`; older row-list snapshots still load.
+`.npy` snapshots keep only the four summarized counters, rows in COLUMNS order, as int32 when they fit.
 """
-import argparse, json, sys, statistics, requests
+import argparse, os, sys
+from functools import lru_cache
+try:
+    from orjson import loads, dumps
+except ImportError:  # orjson is optional here; stdlib json.loads also takes bytes
+    import json
+    loads = json.loads
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+# energy estimate inputs (mV, mA); read once, they do not change within a run
+V_mV = int(os.getenv('POWER_V_SUPPLY_MV') or 5000)
+I_active = int(os.getenv('POWER_I_ACTIVE_MA') or 200)
+I_uplink = int(os.getenv('POWER_I_UPLINK_MA') or 300)
+I_sleep = int(os.getenv('POWER_I_SLEEP_MA') or 5)
+# joules per ms spent in each state: mV * mA * ms = 1e-9 J
+K_SLEEP_J = V_mV*I_sleep*1e-9
+K_UPLINK_J = V_mV*I_uplink*1e-9
+K_IDLE_J = V_mV*I_active*1e-9
+
+SNAPSHOT_WORKERS = 4
+# the four counters a snapshot is reduced over, in column order
+COLUMNS = ('idle_budget_ms', 't_sleep_ms', 't_uplink_ms', 'uplink_bytes')
+
 
+@lru_cache(maxsize=None)
+def _session():
+    # one keep-alive session for every snapshot request (requests already asks for gzip).
+    # imported here so `compare` does not pay for loading requests.
+    import requests
+    s = requests.Session()
+    s.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=SNAPSHOT_WORKERS))
+    s.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=SNAPSHOT_WORKERS))
+    return s
 
-def snapshot(url, device, out):
-    r = requests.get(f"{url.rstrip('/')}/api/power/{device}")
+
+def to_columns(rows):
+    if not rows:
+        return {'n': 0}
+    return {'n': len(rows), **{k: [r[k] for r in rows] for k in rows[0]}}
+
+
+def snapshot(url, device, out, fmt='json'):
+    # stored column-wise: a few flat int lists parse and sum much faster than n small dicts
+    r = _session().get(f"{url.rstrip('/')}/api/power/{device}")
     r.raise_for_status()
-    with open(out, 'w') as f:
-        json.dump(r.json(), f, indent=2)
+    cols = to_columns(loads(r.content))
+    missing = [c for c in COLUMNS if c not in cols] if fmt == 'npy' and cols['n'] else []
+    if missing:   # checked before opening out, so no empty file is left behind
+        raise SystemExit(f"{device}: server response lacks {', '.join(missing)}; cannot write .npy")
+    with open(out, 'wb') as f:
+        if fmt == 'npy':
+            import numpy as np
+            arr = np.array([cols.get(c, ()) for c in COLUMNS], dtype=np.int64).reshape(len(COLUMNS), cols['n'])
+            # ms/byte counters fit int32 (~24 days of ms); half the bytes to write, load and sum
+            i32 = np.iinfo(np.int32)
+            if not arr.size or (arr.min() >= i32.min and arr.max() <= i32.max):
+                arr = arr.astype(np.int32)
+            np.save(f, arr)
+        else:
+            f.write(dumps(cols))
     print(f"Wrote snapshot to {out}")
 
 
-def summarize_list(rows):
-    if not rows:
+def snapshot_many(url, devices, out_dir, fmt='json'):
+    from concurrent.futures import ThreadPoolExecutor
+    os.makedirs(out_dir, exist_ok=True)
+    _session()  # build it before the workers race to
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as ex:
+        futs = [ex.submit(snapshot, url, d, os.path.join(out_dir, f"{d}.{fmt}"), fmt) for d in devices]
+        for f in futs:
+            f.result()
+
+
+def summarize_columns(cols):
+    if not cols['n']:
         return {}
-    idle = [r['idle_budget_ms'] for r in rows]
-    sleep = [r['t_sleep_ms'] for r in rows]
-    uplink = [r['t_uplink_ms'] for r in rows]
-    bytes_ = [r['uplink_bytes'] for r in rows]
-    # energy estimate using env or defaults (mV,mA)
-    import os
-    V_mV = int(os.getenv('POWER_V_SUPPLY_MV') or 5000)
-    I_active = int(os.getenv('POWER_I_ACTIVE_MA') or 200)
-    I_uplink = int(os.getenv('POWER_I_UPLINK_MA') or 300)
-    I_sleep = int(os.getenv('POWER_I_SLEEP_MA') or 5)
-    total_sleep_s = sum(sleep)/1000.0
-    total_uplink_s = sum(uplink)/1000.0
-    total_idle_s = sum(idle)/1000.0
-    V = V_mV/1000.0
-    E_sleep = V*(I_sleep/1000.0)*total_sleep_s
-    E_uplink = V*(I_uplink/1000.0)*total_uplink_s
-    E_idle = V*(I_active/1000.0)*total_idle_s
-    energy_J = E_sleep + E_uplink + E_idle
+    return _summary(cols['n'], *(_total(cols[c]) for c in COLUMNS))
+
+
+def _total(col):
+    # builtin sum for JSON lists, a C reduction for .npy columns (accumulated in int64 even for int32 data)
+    return sum(col) if isinstance(col, list) else int(col.sum(dtype='int64'))
+
+
+def _summary(n, sum_idle, sum_sleep, sum_uplink, sum_bytes):
+    energy_J = K_SLEEP_J*sum_sleep + K_UPLINK_J*sum_uplink + K_IDLE_J*sum_idle
     return {
-        'n': len(rows),
-        'idle_avg': statistics.mean(idle),
-        'sleep_avg': statistics.mean(sleep),
-        'uplink_avg': statistics.mean(uplink),
-        'bytes_avg': statistics.mean(bytes_)
+        'n': n,
+        'idle_avg': sum_idle/n,
+        'sleep_avg': sum_sleep/n,
+        'uplink_avg': sum_uplink/n,
+        'bytes_avg': sum_bytes/n
         , 'est_energy_J': energy_J
     }
 
 
+def load_snapshot(path):
+    with open(path, 'rb') as f:
+        head = f.read(6)
+        data = None if head == b'\x93NUMPY' else head + f.read()
+    if data is None:
+        import numpy as np
+        arr = np.load(path, mmap_mode='r')
+        return {'n': arr.shape[1], **dict(zip(COLUMNS, arr))}
+    snap = loads(data)
+    # row-list snapshots written before the columnar format are converted on load
+    return snap if isinstance(snap, dict) else to_columns(snap)
+
+
+COMPARE_KEYS = (('idle_avg','Idle ms'),('sleep_avg','Sleep ms'),('uplink_avg','Uplink ms'),('bytes_avg','Bytes'))
+
+
 def compare(before_file, after_file):
-    b = json.load(open(before_file))
-    a = json.load(open(after_file))
-    sb = summarize_list(b)
-    sa = summarize_list(a)
-    print("Metric, before, after, delta")
-    keys = [('idle_avg','Idle ms'),('sleep_avg','Sleep ms'),('uplink_avg','Uplink ms'),('bytes_avg','Bytes')]
-    for k,label in keys:
+    import filecmp
+    sb = summarize_columns(load_snapshot(before_file))
+    # back-to-back snapshots of an idle device are often byte-identical; no need to load the second
+    sa = sb if filecmp.cmp(before_file, after_file, shallow=False) else summarize_columns(load_snapshot(after_file))
+    lines = ["Metric, before, after, delta\n"]
+    for k,label in COMPARE_KEYS:
         bv = sb.get(k, 0)
         av = sa.get(k, 0)
-        print(f"{label}, {bv:.2f}, {av:.2f}, {av-bv:.2f}")
+        lines.append("%s, %.2f, %.2f, %.2f\n" % (label, bv, av, av-bv))
+    sys.stdout.write(''.join(lines))
+
+
+def compare_many(paths):
+    import numpy as np
+    snaps = [load_snapshot(p) for p in paths]
+    counts = np.array([s['n'] for s in snaps], dtype=np.int64)
+    # every snapshot's columns laid end to end in one (4, total) array, reduced per snapshot in one go
+    total = int(counts.sum())
+    cols = np.empty((4, total), dtype=np.int64)
+    for i, c in enumerate(COLUMNS):
+        cols[i] = np.concatenate([np.asarray(s.get(c, ()), dtype=np.int64) for s in snaps])
+    csum = np.zeros((total + 1, 4), dtype=np.int64)
+    np.cumsum(cols.T, axis=0, out=csum[1:])
+    ends = counts.cumsum()
+    sums = csum[ends] - csum[ends - counts]
+    avgs = sums / np.maximum(counts, 1)[:, None]
+    energy = sums[:, :3] @ np.array([K_IDLE_J, K_SLEEP_J, K_UPLINK_J])
+    lines = ["Snapshot, n, Idle ms, Sleep ms, Uplink ms, Bytes, Energy J\n"]
+    for p, n, (idle, sleep, uplink, bytes_), e in zip(paths, counts.tolist(), avgs.tolist(), energy.tolist()):
+        lines.append("%s, %d, %.2f, %.2f, %.2f, %.2f, %.3f\n" % (p, n, idle, sleep, uplink, bytes_, e))
+    sys.stdout.write(''.join(lines))
 
 
 if __name__ == '__main__':
@@ -73,14 +176,26 @@ if __name__ == '__main__':
     s1.add_argument('--url', required=True)
     s1.add_argument('--device', required=True)
     s1.add_argument('--out', required=True)
+    s1.add_argument('--format', choices=('json', 'npy'), default='json')
+    s3 = sp.add_parser('snapshot-many')
+    s3.add_argument('--url', required=True)
+    s3.add_argument('--devices', nargs='+', required=True)
+    s3.add_argument('--out-dir', required=True)
+    s3.add_argument('--format', choices=('json', 'npy'), default='json')
     s2 = sp.add_parser('compare')
     s2.add_argument('--before', required=True)
     s2.add_argument('--after', required=True)
+    s4 = sp.add_parser('compare-many')
+    s4.add_argument('--snapshots', nargs='+', required=True)
     args = p.parse_args()
     if args.cmd == 'snapshot':
-        snapshot(args.url, args.device, args.out)
+        snapshot(args.url, args.device, args.out, args.format)
+    elif args.cmd == 'snapshot-many':
+        snapshot_many(args.url, args.devices, args.out_dir, args.format)
     elif args.cmd == 'compare':
         compare(args.before, args.after)
+    elif args.cmd == 'compare-many':
+        compare_many(args.snapshots)
     else:
         p.print_help()
         sys.exit(1)
@@ -1,22 +1,43 @@
 # app.py
-import os, time, base64, json, sqlite3, pathlib, datetime, glob, hmac, io, csv, hashlib
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import os, re, time, base64, binascii, gzip, sqlite3, pathlib, datetime, hmac, io, csv, hashlib, queue, tempfile, threading, struct, zlib, sys, atexit, logging, logging.handlers, functools
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+import orjson
 from typing import List, Tuple, Optional
-from flask import Flask, request, jsonify, g, Response, redirect, url_for
+from flask import Flask, request, jsonify, Response, redirect, url_for, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 import requests
 
 
 # ---- Config via env ----
-AUTH_KEYS_B64 = [k.strip() for k in os.getenv("AUTH_KEYS_B64", "").split(",") if k.strip()]
+AUTH_KEYS_B64 = tuple(dict.fromkeys(k.strip().encode() for k in os.getenv("AUTH_KEYS_B64", "").split(",") if k.strip()))
 REQUIRE_AUTH  = bool(AUTH_KEYS_B64)
 DB_PATH       = os.getenv("SQLITE_PATH", "ecowatt.db")
 LOG_DIR       = os.getenv("LOG_DIR", "logs")
 PSK           = os.getenv("PSK", "ecowatt-demo-psk")
 USE_B64       = bool(int(os.getenv("USE_B64", "1")))  # 1=use base64 envelope
 FOTA_MAX_RETRIES = int(os.getenv("FOTA_MAX_RETRIES", "5"))
+UPLOAD_BATCH_MAX = int(os.getenv("UPLOAD_BATCH_MAX", "256"))      # max rows per writer transaction
+UPLOAD_BATCH_MS  = int(os.getenv("UPLOAD_BATCH_MS", "50"))        # max wait to fill a batch
+UPLOAD_WAIT_S    = float(os.getenv("UPLOAD_WAIT_S", "10"))      # request gives up on the writer (503) after this
+LOG_LEVEL     = os.getenv("LOG_LEVEL", "INFO").upper()           # DEBUG prints every decoded sample
+SQLITE_CACHE_KB   = int(os.getenv("SQLITE_CACHE_KB", "65536"))      # page cache per connection
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", "1073741824"))  # 0 disables mmap I/O
+SQLITE_OPTIMIZE_S = int(os.getenv("SQLITE_OPTIMIZE_S", "3600"))     # PRAGMA optimize period on the writer; 0=off
+ADMIN_CACHE_S     = float(os.getenv("ADMIN_CACHE_S", "1.0"))          # admin + summary query TTL; 0=always query
+GZIP_LEVEL        = int(os.getenv("GZIP_LEVEL", "4"))                 # admin/API response gzip level; 0=off
+GZIP_MIN_BYTES    = int(os.getenv("GZIP_MIN_BYTES", "500"))           # smaller bodies go out uncompressed
+
+# ---- Logging: request threads enqueue records, a listener thread writes stdout ----
+logger = logging.getLogger("ecowatt")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 # Track what we last served, so we can estimate "written"
 # device_id -> {"version":str, "size":int, "chunk_size":int, "next":int, "written":int, "last_served_manifest": version, "cycles_without_progress": 0}
@@ -35,7 +56,8 @@ CREATE TABLE IF NOT EXISTS uploads (
   orig_samples INTEGER,
   orig_bytes   INTEGER,
   received_at  INTEGER NOT NULL,
-  block        BLOB    NOT NULL
+  block        BLOB    NOT NULL,
+  decoded_json BLOB               -- zlib(JSON rows) cache, filled at ingest or first view
 );
 CREATE INDEX IF NOT EXISTS idx_uploads_dev_ts ON uploads (device_id, ts_start, ts_end);
 
@@ -46,6 +68,8 @@ CREATE TABLE IF NOT EXISTS fota_events(
   kind TEXT,          -- 'manifest','chunk','verify_ok','verify_fail','boot_ok','boot_rollback','corruption_detected','rollback'
   detail TEXT
 );
+CREATE INDEX IF NOT EXISTS idx_fota_events_ts ON fota_events(ts DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_fota_events_dev_ts ON fota_events(device, ts DESC, id DESC);
 
 CREATE TABLE IF NOT EXISTS fota_progress(
   device TEXT PRIMARY KEY,
@@ -82,6 +106,7 @@ CREATE TABLE IF NOT EXISTS power_stats (
   uplink_bytes  INTEGER NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_power_stats_dev_time ON power_stats(device, received_at);
+CREATE INDEX IF NOT EXISTS idx_power_stats_time ON power_stats(received_at);
 
 CREATE TABLE IF NOT EXISTS buffer_stats (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -100,6 +125,7 @@ CREATE TABLE IF NOT EXISTS device_events (
   event       TEXT NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_dev_events ON device_events(device, received_at);
+CREATE INDEX IF NOT EXISTS idx_dev_events_time ON device_events(received_at);
 
 CREATE TABLE IF NOT EXISTS sim_faults (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -117,7 +143,45 @@ CREATE INDEX IF NOT EXISTS idx_sim_faults_device ON sim_faults(device, created_a
 
 """
 
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify / request.get_json through orjson; types orjson can't encode fall back to Flask's default"""
+    _OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def _options(self) -> int:
+        # honour Flask's sort_keys (on by default) like the stdlib provider did
+        return self._OPTS | orjson.OPT_SORT_KEYS if self.sort_keys else self._OPTS
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self._options()),
+                                        mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# device-facing routes stay uncompressed: the firmware HTTP client doesn't inflate
+_GZIP_SKIP = ("/api/device/", "/api/fota/chunk")
+
+@app.after_request
+def _gzip_response(resp: Response) -> Response:
+    """gzip JSON/HTML for admin browsers and API tooling that send Accept-Encoding: gzip"""
+    if (not GZIP_LEVEL or resp.direct_passthrough or resp.is_streamed or resp.status_code != 200
+            or "Content-Encoding" in resp.headers or resp.mimetype not in ("application/json", "text/html")
+            or request.path.startswith(_GZIP_SKIP)
+            or request.accept_encodings["gzip"] <= 0):   # parsed q-values: "gzip;q=0" is a refusal
+        return resp
+    data = resp.get_data()
+    if len(data) < GZIP_MIN_BYTES: return resp
+    resp.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    return resp
 
 # ------------ auth ------------
 def _auth_ok(header: str) -> bool:
@@ -126,7 +190,9 @@ def _auth_ok(header: str) -> bool:
     token = header.strip()
     if token.lower().startswith("basic "):
         token = token[6:].strip()
-    return token in AUTH_KEYS_B64
+    # deliberately a linear scan over every key (no set lookup, no short-circuit) so timing reveals nothing
+    tok = token.encode()
+    return any([hmac.compare_digest(tok, k) for k in AUTH_KEYS_B64])
 
 # ------------ DB open + migration ------------
 def _migrate(db: sqlite3.Connection) -> None:
@@ -138,6 +204,8 @@ def _migrate(db: sqlite3.Connection) -> None:
         db.execute("ALTER TABLE uploads ADD COLUMN orig_samples INTEGER"); changed = True
     if "orig_bytes" not in cols:
         db.execute("ALTER TABLE uploads ADD COLUMN orig_bytes INTEGER"); changed = True
+    if "decoded_json" not in cols:
+        db.execute("ALTER TABLE uploads ADD COLUMN decoded_json BLOB"); changed = True
     if changed: db.commit()
     
     # Migrate fota_progress table to add status column if it doesn't exist
@@ -179,23 +247,207 @@ def _migrate(db: sqlite3.Connection) -> None:
         print(f"[MIGRATE] sim_faults description column check: {e}")
 
 
+def _apply_pragmas(db: sqlite3.Connection) -> None:
+    db.execute("PRAGMA journal_mode=WAL;")
+    db.execute("PRAGMA synchronous=NORMAL;")
+    db.execute("PRAGMA busy_timeout=5000;")          # wait out the writer's BEGIN IMMEDIATE instead of SQLITE_BUSY
+    db.execute("PRAGMA temp_store=MEMORY;")          # ORDER BY / GROUP BY temp b-trees stay in RAM
+    db.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB};")   # 64 MiB page cache by default
+    db.execute("PRAGMA wal_autocheckpoint=1000;")
+    if DB_PATH != ":memory:" and not DB_PATH.startswith("file::memory:"):
+        db.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES};")   # 1 GiB default; BLOB reads become mmap loads
+
+# Prepared statements are cached per connection, keyed by SQL text; room for
+# every distinct query the handlers issue, so none gets re-prepared.
+SQL_STMT_CACHE = 256
+
+# One long-lived autocommit connection per worker thread (waitress reuses its
+# threads), so PRAGMAs run once per thread, not per request; DDL and migration
+# run once per process, on whichever connection opens first.
+_pool = threading.local()
+_pool_conns = {}    # Thread -> Connection, for reaping dead threads and shutdown
+_pool_lock = threading.Lock()
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def _ensure_schema(db: sqlite3.Connection) -> None:
+    global _schema_ready
+    if _schema_ready: return
+    with _schema_lock:
+        if not _schema_ready:
+            db.executescript(DDL)
+            _migrate(db)
+            _schema_ready = True
+
 def get_db():
-    if "db" not in g:
-        g.db = sqlite3.connect(DB_PATH, check_same_thread=False)
-        g.db.execute("PRAGMA journal_mode=WAL;")
-        g.db.execute("PRAGMA synchronous=NORMAL;")
-        g.db.executescript(DDL)
-        _migrate(g.db)
-    return g.db
-
-@app.teardown_appcontext
-def close_db(_=None):
-    db = g.pop("db", None)
-    if db is not None: db.close()
+    db = getattr(_pool, "db", None)
+    if db is None:
+        db = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=SQL_STMT_CACHE)
+        _apply_pragmas(db)
+        _ensure_schema(db)
+        with _pool_lock:
+            for t in [t for t in _pool_conns if not t.is_alive()]:
+                _pool_conns.pop(t).close()
+            _pool_conns[threading.current_thread()] = db
+        _pool.db = db
+    return db
+
+@atexit.register
+def close_db_pool():
+    with _pool_lock:
+        for db in _pool_conns.values():
+            try: db.execute("PRAGMA optimize;")   # recommended before closing a long-lived connection
+            except sqlite3.Error: pass
+            db.close()
+        _pool_conns.clear()
+
+# ------------ batched upload writer ------------
+# device_upload hands its row to a single writer thread, which commits
+# queued rows together (one transaction per batch) and resolves each
+# request's Future with the committed rowid. An upload's optional stats
+# rows travel in the same queue item, so the upload and its stats commit
+# in one transaction.
+UPLOAD_INSERT_SQL = """INSERT INTO uploads
+                   (device_id, ts_start, ts_end, seq, codec, order_json, ts_list_json,
+                    orig_samples, orig_bytes, received_at, block, decoded_json)
+                   VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"""
+# optional per-upload stats, queued with the upload by enqueue_upload()
+EVENT_INSERT_SQL = "INSERT INTO device_events(device, received_at, event) VALUES(?,?,?)"
+POWER_INSERT_SQL = """INSERT INTO power_stats(device, received_at, t_sleep_ms, t_manual_sleep_ms, t_auto_sleep_ms,
+                      t_uplink_ms, uplink_bytes, idle_budget_ms) VALUES(?,?,?,?,?,?,?,?)"""
+DIAG_INSERT_SQL  = "INSERT INTO buffer_stats(device, received_at, dropped_samples, acq_failures, transport_failures) VALUES(?,?,?,?,?)"
+FOTA_EVENT_SQL   = "INSERT INTO fota_events(device,kind,detail) VALUES(?,?,?)"
+
+# entries are lists of (params, fut, stats): one per upload, or a whole upload_batch request
+UPLOAD_QUEUE: "queue.Queue[List[Tuple[tuple, Future, list]]]" = queue.Queue()
+_upload_writer = None
+_upload_writer_lock = threading.Lock()
+
+def _drain_uploads(first):
+    batch = list(first)   # queue entries are never split across transactions
+    deadline = time.monotonic() + UPLOAD_BATCH_MS / 1000.0
+    while len(batch) < UPLOAD_BATCH_MAX:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0: break
+        try:
+            batch.extend(UPLOAD_QUEUE.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return batch
+
+def _commit_uploads(conn: sqlite3.Connection, batch: list) -> int:
+    """Insert a batch (and its stats rows) in one transaction; returns the last rowid"""
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # executemany drops RETURNING rows in the stdlib driver, so the ids
+        # come from one last_insert_rowid() per batch instead of per row
+        conn.executemany(UPLOAD_INSERT_SQL, [params for params, _, _ in batch])
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        for _, _, stats in batch:
+            if stats: _write_stats(conn, stats)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction: conn.execute("ROLLBACK")
+        raise
+    return last_id
+
+def _write_batch(conn: sqlite3.Connection, batch: list):
+    try:
+        last_id = _commit_uploads(conn, batch)
+    except Exception as e:
+        logger.error("[UPLOAD] batch insert error (%d rows): %s", len(batch), e)
+        if len(batch) == 1:
+            batch[0][1].set_exception(e)
+            return
+        # retry row by row so only the offending upload fails, not its batch-mates
+        for item in batch:
+            try:
+                item[1].set_result(_commit_uploads(conn, [item]))
+            except Exception as e1:
+                item[1].set_exception(e1)
+        return
+    # single writer + one transaction => rowids are consecutive
+    first_id = last_id - len(batch) + 1
+    for i, (_, fut, _) in enumerate(batch):
+        fut.set_result(first_id + i)
+
+def _upload_writer_loop():
+    global _upload_writer
+    batch = []
+    try:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, cached_statements=SQL_STMT_CACHE)
+        _apply_pragmas(conn)
+        _ensure_schema(conn)
+        last_optimize = time.monotonic()
+        while True:
+            batch = _drain_uploads(UPLOAD_QUEUE.get())
+            # skip entries whose request already gave up (503): the device resends those
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            # refresh planner stats now and then; cheap, and only touches tables that changed
+            if SQLITE_OPTIMIZE_S and time.monotonic() - last_optimize >= SQLITE_OPTIMIZE_S:
+                try: conn.execute("PRAGMA optimize;")
+                except sqlite3.Error as e: logger.warning("[DB] optimize error: %s", e)
+                last_optimize = time.monotonic()
+            if batch: _write_batch(conn, batch)
+            batch = []
+    except BaseException as e:
+        # fatal (cannot open the DB, connection lost, ...): fail everything waiting on
+        # this thread and let the next enqueue_upload() start a fresh writer
+        logger.error("[UPLOAD] writer stopped: %r", e)
+        # drain before clearing _upload_writer, both under the lock: a replacement writer
+        # can only start afterwards, so nothing queued for it is failed here
+        with _upload_writer_lock:
+            pending = list(batch)
+            while True:
+                try: pending.extend(UPLOAD_QUEUE.get_nowait())
+                except queue.Empty: break
+            _upload_writer = None
+        err = RuntimeError(f"upload writer stopped: {e!r}")
+        for _, fut, _ in pending:
+            if fut.done(): continue
+            if fut.running() or fut.set_running_or_notify_cancel(): fut.set_exception(err)
+
+def _start_upload_writer():
+    global _upload_writer
+    # always under the lock: a dying writer holds it while it drains the queue
+    with _upload_writer_lock:
+        if _upload_writer is None:
+            _upload_writer = threading.Thread(target=_upload_writer_loop, name="upload-writer", daemon=True)
+            _upload_writer.start()
+
+def enqueue_upload(params: tuple, stats: Optional[list] = None) -> Future:
+    """Queue an uploads row (plus its optional stats rows) for the writer thread;
+    the Future yields the rowid once both have committed in the same transaction"""
+    return enqueue_uploads([(params, stats)])[0]
+
+def enqueue_uploads(items: List[Tuple[tuple, Optional[list]]]) -> List[Future]:
+    """Queue several (params, stats) uploads as one entry, so the writer commits them in one transaction"""
+    entry = [(params, Future(), stats or []) for params, stats in items]
+    UPLOAD_QUEUE.put(entry)
+    _start_upload_writer()   # after put: a writer that dies now still fails these items
+    return [fut for _, fut, _ in entry]
+
+def await_upload(fut: Future, timeout: Optional[float] = None) -> int:
+    """rowid of a queued upload, waiting at most timeout (UPLOAD_WAIT_S). On timeout the entry is
+    cancelled so the writer skips it: the device resends on non-2xx, and committing the
+    abandoned copy too would duplicate the row. If the writer has already taken it, its commit is waited for."""
+    try:
+        return fut.result(timeout=UPLOAD_WAIT_S if timeout is None else timeout)
+    except FutureTimeout:   # the builtin TimeoutError only from 3.11 on
+        if fut.cancel(): raise
+        return fut.result(timeout=UPLOAD_WAIT_S)
+
+def _write_stats(conn: sqlite3.Connection, stats: list):
+    """Best-effort optional stats inserts inside the writer's transaction; items are (tag, sql, rows)"""
+    for tag, sql, rows in stats:
+        try:
+            conn.executemany(sql, rows)
+        except sqlite3.Error as e:   # only this statement is undone; the rest still commit
+            logger.warning("[%s] insert error: %s", tag, e)
+
 def log_fota(device, kind, detail=""):
     db = get_db()
-    db.execute("INSERT INTO fota_events(device,kind,detail) VALUES(?,?,?)",
-               (device, kind, detail))
+    db.execute(FOTA_EVENT_SQL, (device, kind, detail))
     db.commit()
 
 def upsert_progress(device, version, size, written, status="pending"):
@@ -221,37 +473,71 @@ def upsert_fota_version(device, version, size, hash_hex, status):
     """, (device, version, size, hash_hex, status))
     db.commit()
 
-def cleanup_fota_files(version=None, reason="cleanup"):
+def _fota_chunk_paths() -> List[str]:
+    """Chunk files in LOG_DIR from a single directory listing (no fnmatch per entry)"""
+    try:
+        with os.scandir(LOG_DIR) as it:
+            names = [e.name for e in it if e.name.startswith("fota_chunk_") and e.name.endswith(".b64")]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(LOG_DIR, n) for n in sorted(names)]
+
+# chunk deletion runs here so device_upload does not wait on N unlinks; one worker keeps jobs ordered
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fota-cleanup")
+_fota_cleanup_job: Optional[Future] = None
+
+def _remove_fota_chunks(reason: str):
+    chunk_files = _fota_chunk_paths()
+    for chunk_file in chunk_files:
+        try:
+            os.remove(chunk_file)
+        except FileNotFoundError:
+            pass
+    _chunk_b64.cache_clear()
+    if chunk_files:
+        logger.info("[FOTA] Cleaned %d chunk files (%s)", len(chunk_files), reason)
+
+def _wait_fota_cleanup():
+    """Let a queued chunk cleanup finish before a new image's chunks are written"""
+    job = _fota_cleanup_job
+    if job is not None:
+        try:
+            job.result()
+        except Exception as e:
+            logger.error("[FOTA] Error during cleanup: %s", e)
+
+def cleanup_fota_files(version=None, reason="cleanup", background=False):
     """Remove manifest and all chunk files from logs folder
     
     Args:
         version: If provided, only delete if manifest matches this version (safety check)
         reason: Log message for why cleanup occurred
+        background: Remove the manifest now but leave the chunk files to the cleanup worker
     """
+    global _fota_cleanup_job
     try:
         man_path = os.path.join(LOG_DIR, "fota_manifest.json")
         
         # If version check requested, verify manifest matches
         if version is not None and os.path.exists(man_path):
             try:
-                mf = json.loads(open(man_path, "r").read())
+                mf = _read_json(man_path)
                 if mf.get("version") != version:
                     print(f"[FOTA] Cleanup skipped: manifest version {mf.get('version')} != {version} ({reason})", flush=True)
                     return False
             except Exception as e:
                 print(f"[FOTA] Warning: couldn't verify manifest version: {e}", flush=True)
         
-        # Remove manifest
+        # Remove manifest (inline, so the rest of this request no longer offers it)
         if os.path.exists(man_path):
-            os.remove(man_path)
+            _remove_json(man_path)
             print(f"[FOTA] Cleaned manifest ({reason})", flush=True)
         
         # Remove all chunk files
-        chunk_files = glob.glob(os.path.join(LOG_DIR, "fota_chunk_*.b64"))
-        for chunk_file in chunk_files:
-            os.remove(chunk_file)
-        if chunk_files:
-            print(f"[FOTA] Cleaned {len(chunk_files)} chunk files ({reason})", flush=True)
+        if background:
+            _fota_cleanup_job = _CLEANUP_POOL.submit(_remove_fota_chunks, reason)
+        else:
+            _remove_fota_chunks(reason)
         
         return True
     except Exception as e:
@@ -260,6 +546,9 @@ def cleanup_fota_files(version=None, reason="cleanup"):
 
 # ---- SIM Fault Injection ----
 SIM_API_BASE = "http://20.15.114.131:8080"
+# keep-alive pool for the SIM API: admin fault clicks reuse a connection instead of reconnecting
+_SIM_SESSION = requests.Session()
+_SIM_SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=1))
 
 def queue_sim_fault(device, error_type, exception_code=0, delay_ms=0):
     """Queue a fault for the next Inverter SIM request from a device"""
@@ -307,7 +596,7 @@ def trigger_sim_fault_at_inverter(error_type, exception_code=0, delay_ms=0, slav
             "Authorization": sim_key,
             "Content-Type": "application/json"
         }
-        resp = requests.post(url, json=payload, headers=headers, timeout=5)
+        resp = _SIM_SESSION.post(url, json=payload, headers=headers, timeout=5)
         if resp.status_code == 200:
             print(f"[SIM] Persistent error flag set via /api/user/error-flag/add: {error_type}", flush=True)
             return True
@@ -326,7 +615,7 @@ def trigger_sim_fault_at_inverter(error_type, exception_code=0, delay_ms=0, slav
             "exceptionCode": exception_code,
             "delayMs": delay_ms
         }
-        resp = requests.post(url, json=payload, timeout=5)
+        resp = _SIM_SESSION.post(url, json=payload, timeout=5)
         if resp.status_code == 200:
             print(f"[SIM] Immediate error frame generated via /api/inverter/error: {error_type}", flush=True)
             return True
@@ -356,80 +645,154 @@ GAIN = {
     "temp": 10.0, "export_percent": 1.0, "pac": 1.0
 }
 
-def decode_delta_rle_v1(block: bytes, order: List[str]) -> Tuple[List[List[int]], str]:
-    def u16(b, o): return b[o] | (b[o+1]<<8)
-    def s16(b, o):
-        v = u16(b,o)
-        return v-0x10000 if v & 0x8000 else v
+_HDR = struct.Struct("<BBH")   # ver, nf, n
+_S16 = struct.Struct("<h")
+_ZERO_RUNS = tuple((0,)*i for i in range(256))   # RLE run length is one byte
 
+def _decode_core(block: bytes, pos: int, init: Tuple[int, ...], n: int) -> Tuple[Optional[np.ndarray], str]:
+    """Walk the per-field opcode streams of a delta_rle_v1 body into an (nf, n) array.
+
+    Only signed deltas are collected (RLE runs are zero deltas); each field is
+    then rebuilt with a single cumsum masked to 16 bits. The loop runs once per
+    opcode, so everything it touches is bound to a local first.
+    """
+    s16=_S16.unpack_from; zero_runs=_ZERO_RUNS
+    end=len(block)-4; last=n-1
+    fields=np.empty((len(init), n), dtype=np.uint16)
+    for f, first in enumerate(init):
+        deltas=[first]; append=deltas.append; extend=deltas.extend; produced=0
+        while produced < last:
+            if pos >= end: return None, "early EOF"
+            op = block[pos]
+            if op==0x01:
+                if pos+3>end: return None, "EOF delta"
+                append(s16(block,pos+1)[0]); pos+=3; produced+=1
+            elif op==0x00:
+                if pos+1>=end: return None, "EOF len"
+                rep=block[pos+1]; pos+=2
+                if produced+rep > last: return None, "bad run"
+                extend(zero_runs[rep]); produced+=rep
+            else:
+                return None, "bad op"
+        fields[f] = np.cumsum(np.asarray(deltas, dtype=np.int64)) & 0xFFFF
+    return fields, "ok"
+
+_TOKEN = re.compile(rb"\x01..|\x00.", re.S)   # one delta_rle_v1 opcode with its operand
+
+def _decode_tokens(block: bytes, pos: int, init: Tuple[int, ...], n: int) -> Optional[np.ndarray]:
+    """Vectorized walk of a well-formed delta_rle_v1 body (n > 1) into an (nf, n) array.
+
+    The regex splits the opcode stream in C; NumPy then assigns the tokens to
+    fields from one cumsum of samples produced and scatters the deltas. Returns
+    None for anything irregular (bad opcode, overlong run, truncation) so the
+    caller falls back to _decode_core, which reports the exact error.
+    """
+    nf=len(init); last=n-1
+    if nf == 0: return None   # nothing to assign tokens to; _decode_core yields the empty rows
+    region=block[pos:len(block)-4]
+    toks=_TOKEN.findall(region)
+    if not toks: return None
+    joined=b"".join(toks)
+    lens=np.frombuffer(bytes(map(len, toks)), dtype=np.uint8)
+    starts=np.cumsum(lens, dtype=np.int64) - lens
+    jb=np.frombuffer(joined, dtype=np.uint8)
+    is_d=jb[starts]==0x01
+    cum=np.cumsum(np.where(is_d, 1, jb[starts+1]), dtype=np.int64)   # samples produced so far
+    targets=np.arange(1, nf+1, dtype=np.int64)*last
+    idx=np.searchsorted(cum, targets)     # token that completes each field
+    if idx[-1] >= len(cum) or (cum[idx] != targets).any(): return None
+    used=int(idx[-1])+1
+    # findall skips bytes it cannot tokenize; the tokens read must be the stream itself
+    span=int(starts[used-1])+int(lens[used-1])
+    if joined[:span] != region[:span]: return None
+    d=is_d[:used]; st=starts[:used][d]
+    flat=np.zeros(nf*last, dtype=np.int64)    # RLE runs stay zero deltas
+    flat[cum[:used][d]-1]=(jb[st+1] | (jb[st+2].astype(np.uint16) << 8)).view(np.int16)
+    deltas=np.empty((nf, n), dtype=np.int64)
+    deltas[:, 0]=init
+    deltas[:, 1:]=flat.reshape(nf, last)
+    return (np.cumsum(deltas, axis=1) & 0xFFFF).astype(np.uint16)
+
+def decode_delta_rle_v1(block: bytes, order: List[str]) -> Tuple[np.ndarray, str]:
+    """Decoded samples as an (n, nf) uint16 array; empty list plus a note on failure"""
     if len(block) < 12: return [], "short"
-    pos=0
-    ver=block[pos]; pos+=1
-    nf =block[pos]; pos+=1
-    n  =u16(block,pos); pos+=2
-    pos+=4
+    ver, nf, n = _HDR.unpack_from(block, 0)
+    pos=8
     if ver!=1 or nf!=len(order) or n==0: return [], "header mismatch or empty"
     if len(block) < pos + nf*2 + 4: return [], "truncated"
 
-    last=[u16(block,pos+2*i) for i in range(nf)]
+    init=struct.unpack_from(f"<{nf}H", block, pos)
     pos+=nf*2
-    fields=[[0]*n for _ in range(nf)]
-    for f in range(nf):
-        fields[f][0]=last[f]; produced=0
-        while produced < n-1:
-            if pos >= len(block)-4: return [], "early EOF"
-            op = block[pos]; pos+=1
-            if op==0x00:
-                if pos>=len(block)-4: return [], "EOF len"
-                rep=block[pos]; pos+=1
-                for _ in range(rep): fields[f][1+produced]=last[f]; produced+=1
-            elif op==0x01:
-                if pos+2>len(block)-4: return [], "EOF delta"
-                d=s16(block,pos); pos+=2
-                cur=(last[f]+d)&0xFFFF
-                fields[f][1+produced]=cur; last[f]=cur; produced+=1
-            else:
-                return [], "bad op"
-
-    rows=[[fields[f][i] for f in range(nf)] for i in range(n)]
-    return rows, "ok"
+    fields = _decode_tokens(block, pos, init, n) if n > 1 else None
+    if fields is None:
+        fields, note = _decode_core(block, pos, init, n)
+        if fields is None: return [], note
+
+    return np.ascontiguousarray(fields.T), "ok"   # orjson only serializes C-contiguous arrays
+
+def _pack_rows(rows) -> bytes:
+    return zlib.compress(orjson.dumps(rows, option=orjson.OPT_SERIALIZE_NUMPY))
+
+def _decoded_rows(db: sqlite3.Connection, rowid: int, codec: str, blob: bytes,
+                  order: List[str], cached: Optional[bytes]):
+    """Rows for an upload, from the decoded_json cache when present.
+    Uploads stored before the cache existed are decoded once and back-filled."""
+    if cached is not None:
+        return orjson.loads(zlib.decompress(cached)), "ok"
+    if codec != "delta_rle_v1":
+        return [], "unsupported"
+    rows, note = decode_delta_rle_v1(blob, order)
+    if note == "ok":
+        try:
+            db.execute("UPDATE uploads SET decoded_json=? WHERE id=? AND decoded_json IS NULL", (_pack_rows(rows), rowid))
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning("[DECODE] cache store failed for upload %s: %s", rowid, e)
+    return rows, note
+
+def _field_formatter(name: str):
+    g = GAIN.get(name, 1.0)
+    if name == "fac1": return lambda v: f"{name}={v/g:.2f}Hz"
+    if name in ("vac1","vpv1","vpv2"): return lambda v: f"{name}={v/g:.1f}V"
+    if name in ("iac1","ipv1","ipv2"): return lambda v: f"{name}={v/g:.1f}A"
+    if name == "temp": return lambda v: f"{name}={v/g:.1f}C"
+    if name == "export_percent": return lambda v: f"{name}={int(v)}%"
+    if name == "pac": return lambda v: f"{name}={int(v)}W"
+    return lambda v: f"{name}={v}"
+
+@functools.lru_cache(maxsize=64)
+def _compile_order(order: Tuple[str, ...]):
+    """Per-field formatters for an upload's field order, built once per order"""
+    return tuple(_field_formatter(name) for name in order)
 
 def _fmt_row(order: List[str], raw: List[int]) -> str:
-    parts=[]
-    for name, val in zip(order, raw):
-        g = GAIN.get(name, 1.0)
-        if name == "fac1": parts.append(f"{name}={val/g:.2f}Hz")
-        elif name in ("vac1","vpv1","vpv2"): parts.append(f"{name}={val/g:.1f}V")
-        elif name in ("iac1","ipv1","ipv2"):  parts.append(f"{name}={val/g:.1f}A")
-        elif name == "temp": parts.append(f"{name}={val/g:.1f}C")
-        elif name == "export_percent": parts.append(f"{name}={int(val)}%")
-        elif name == "pac": parts.append(f"{name}={int(val)}W")
-        else: parts.append(f"{name}={val}")
-    return " ".join(parts)
+    return " ".join([fmt(val) for fmt, val in zip(_compile_order(tuple(order)), raw)])
 
 def _looks_epoch_ms(v: int) -> bool: return v >= 1_000_000_000_000
 
 def _device_ms_list(n: int, ts0: int, ts1: int):
     if n <= 1 or ts0 == ts1: return [ts0]*max(n,1)
-    return [int(round(ts0 + i * (ts1 - ts0) / (n - 1))) for i in range(n)]
+    return np.linspace(ts0, ts1, n).round().astype(np.int64).tolist()
 
 def _epoch_ms_list(n: int, ts0: int, ts1: int, recv: int, ts_list_opt: Optional[List[int]]):
     if ts_list_opt and len(ts_list_opt) >= n:
-        xs = [int(v) for v in ts_list_opt[:n]]
-        if all(_looks_epoch_ms(v) for v in xs): return xs
-        out=[]
-        for x in xs:
-            if ts1 == ts0: out.append(recv)
-            else:
-                frac=(x-ts0)/(ts1-ts0); out.append(int(recv-(1.0-frac)*(ts1-ts0)))
-        return out
-    devs=_device_ms_list(n, ts0, ts1)
-    out=[]
-    for d in devs:
-        if ts1 == ts0: out.append(recv)
-        else:
-            frac=(d-ts0)/(ts1-ts0); out.append(int(recv-(1.0-frac)*(ts1-ts0)))
-    return out
+        # probe one sample first: device-ms lists (the common case) skip the full scan
+        epoch_like = n == 0 or _looks_epoch_ms(int(ts_list_opt[0]))
+        try:
+            xs = np.asarray(ts_list_opt[:n], dtype=np.int64)
+        except OverflowError:   # beyond int64: rows stored before ingest range-checked ts_list
+            xs = [int(v) for v in ts_list_opt[:n]]
+            if all(_looks_epoch_ms(v) for v in xs): return xs
+            if ts1 == ts0: return [recv]*len(xs)
+            return [int(recv - (1.0 - (x - ts0) / (ts1 - ts0)) * (ts1 - ts0)) for x in xs]
+        if epoch_like and (xs >= 1_000_000_000_000).all(): return xs.tolist()
+    else:
+        devs = _device_ms_list(n, ts0, ts1)
+        xs = np.asarray(devs, dtype=np.int64)
+    if ts1 == ts0: return [recv]*len(xs)
+    # map device ms onto the server clock so the last sample lands on recv
+    frac = (xs - ts0) / (ts1 - ts0)
+    return (recv - (1.0 - frac) * (ts1 - ts0)).astype(np.int64).tolist()
 
 HTML_HEAD = """<!doctype html><html><head><meta charset="utf-8">
 <title>EcoWatt Admin</title>
@@ -487,9 +850,78 @@ button:hover{background:#0052a3}
 """
 HTML_TAIL = """</div></body></html>"""
 
+_JSON_FILE_CACHE = {}   # path -> ((mtime_ns, size, ino), parsed)
+
+def _read_json(path: str):
+    """Parse a JSON control file (manifest / config_update / command) with orjson.
+
+    Every upload consults these files, so the parsed value is kept until the
+    file's stat signature changes; callers treat it as read-only.
+    """
+    st = os.stat(path)
+    sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+    hit = _JSON_FILE_CACHE.get(path)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    with open(path, "rb") as f:
+        obj = orjson.loads(f.read())
+    _JSON_FILE_CACHE[path] = (sig, obj)
+    return obj
+
+def _remove_json(path: str) -> None:
+    """Delete a control file and forget its parsed value, so a later file that
+    happens to reuse the inode, size and mtime is never answered from the cache"""
+    _JSON_FILE_CACHE.pop(path, None)
+    os.remove(path)
+
+_UMASK = os.umask(0); os.umask(_UMASK)   # read once at import, while still single-threaded
+
+def _atomic_write_bytes(path: str, data: bytes) -> None:
+    """Write through a temp file in the same directory and os.replace it in,
+    so a device upload never reads a half-written control file or manifest"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o666 & ~_UMASK)   # mkstemp makes 0600; give it the mode open() would
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+
+@functools.lru_cache(maxsize=256)
+def _chunk_b64(path: str, sig: tuple) -> str:
+    """A FOTA chunk's base64 text; sig (mtime_ns, size, ino) keys out rewritten files"""
+    with open(path, "rb") as f:
+        return f.read().strip().decode("ascii")
+
+@functools.lru_cache(maxsize=None)
+def _plt():
+    """pyplot on the Agg backend, imported on first use: only the power snapshot draws"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _json_response(obj, status: int = 200) -> Response:
+    """jsonify with a status: same OrjsonProvider, so one encoder and option set for every JSON reply"""
+    resp = app.json.response(obj)
+    resp.status_code = status
+    return resp
+
 # ---------------- Security envelope ----------------
-def _hmac_hex(key: str, msg: str) -> str:
-    return hmac.new(key.encode(), msg.encode(), "sha256").hexdigest()
+def _hmac_bytes(key: str, msg: str) -> bytes:
+    return hmac.new(key.encode(), msg.encode(), "sha256").digest()
+
+def _mac_bytes(mac) -> bytes:
+    # hex MAC from the wire -> raw 32-byte digest; anything malformed becomes b"" and fails the compare
+    try:
+        return bytes.fromhex(mac) if isinstance(mac, str) and len(mac) == 64 else b""
+    except ValueError:
+        return b""
 
 def _try_unwrap_envelope(raw: dict) -> Optional[dict]:
     # If envelope-like, verify and extract payload
@@ -497,20 +929,28 @@ def _try_unwrap_envelope(raw: dict) -> Optional[dict]:
         nonce = str(raw.get("nonce"))
         payload = raw.get("payload", "")
         mac     = raw.get("mac", "")
-        calc    = _hmac_hex(PSK, f"{nonce}.{payload}")
-        if not hmac.compare_digest(mac, calc):
+        calc    = _hmac_bytes(PSK, f"{nonce}.{payload}")
+        if not hmac.compare_digest(_mac_bytes(mac), calc):
             return None
         try:
             if USE_B64:
-                payload = base64.b64decode(payload)
-                return json.loads(payload.decode())
-            else:
-                return json.loads(payload)
+                payload = binascii.a2b_base64(payload)   # what b64decode calls, minus its wrapper
+            return orjson.loads(payload)
         except Exception:
             return None
     # Not an envelope → treat as plain JSON body
     return raw
 
+def _b64decode_block(s: str) -> bytes:
+    """Single-pass base64 decode for block_b64.
+    a2b_base64 silently skips characters outside the alphabet, so a result
+    shorter than the length implied by the input means it was not clean base64."""
+    blob = binascii.a2b_base64(s)
+    pad = 2 if s.endswith("==") else 1 if s.endswith("=") else 0
+    if len(s) % 4 or len(blob) != len(s) // 4 * 3 - pad:
+        raise binascii.Error("invalid base64")
+    return blob
+
 def _wrap_envelope(obj: dict) -> dict:
     """
     Wrap object in HMAC-signed envelope.
@@ -523,13 +963,13 @@ def _wrap_envelope(obj: dict) -> dict:
     test_invalid_b64 = obj.pop("_test_invalid_b64", None)
     test_missing_mac = obj.pop("_test_missing_mac", None)
     
-    s = json.dumps(obj, separators=(",", ":"))
+    s = orjson.dumps(obj)
     
     # Handle invalid base64 test
     if test_invalid_b64:
         payload = "not!!!valid!!!base64!!!"
     else:
-        payload = base64.b64encode(s.encode()).decode() if USE_B64 else s
+        payload = base64.b64encode(s).decode() if USE_B64 else s.decode()
     
     # Use old nonce for replay test
     if test_replay_nonce:
@@ -539,7 +979,7 @@ def _wrap_envelope(obj: dict) -> dict:
     
     # Sign with wrong PSK for wrong_psk test
     key_for_mac = "wrong-psk-test-key" if test_wrong_psk else PSK
-    mac = _hmac_hex(key_for_mac, f"{nonce}.{payload}")
+    mac = _hmac_bytes(key_for_mac, f"{nonce}.{payload}").hex()
     
     # Corrupt MAC for bad_hmac test
     if test_tamper_mac:
@@ -584,21 +1024,112 @@ def index():
     """
     return Response(html, mimetype="text/html")
 
+@functools.lru_cache(maxsize=64)
+def _order_json_cached(order: Tuple[str, ...]) -> str:
+    return orjson.dumps(order).decode()
+
+def _order_json(order: list) -> str:
+    """order_json column text; devices send the same few field orders, so encode each once"""
+    try:
+        return _order_json_cached(tuple(order))
+    except TypeError:   # unhashable entries, not worth caching
+        return orjson.dumps(order).decode()
+
+def _int64(v) -> int:
+    """int() that also rejects what SQLite cannot bind as INTEGER"""
+    v = int(v)
+    if not -2**63 <= v < 2**63: raise OverflowError("out of INTEGER range")
+    return v
+
+def _opt_int(v) -> Optional[int]:
+    return None if v is None else _int64(v)
+
+def _prepare_upload(body: dict, now_ms: int):
+    """Validate one telemetry body and build its uploads row plus optional stats rows.
+    Returns (params, stats, rows, note); params is None and note is the error code when invalid."""
+    for f in ("device_id","ts_start","ts_end","codec","order","block_b64"):
+        if f not in body:
+            return None, None, [], "missing-fields"
+
+    try:
+        blob = _b64decode_block(body["block_b64"])
+    except (ValueError, TypeError):   # binascii.Error is a ValueError
+        return None, None, [], "bad-base64"
+
+    # every bound value is coerced here: one unbindable row would otherwise fail the writer's whole batch
+    try:
+        dev   = str(body["device_id"])
+        ts0   = _int64(body["ts_start"])
+        ts1   = _int64(body["ts_end"])
+        seq   = _int64(body.get("seq", 0))
+        codec = str(body["codec"])
+        order = list(body["order"])
+        orig_samples = _opt_int(body.get("orig_samples"))
+        orig_bytes   = _opt_int(body.get("orig_bytes"))
+        order_json   = _order_json(order)
+        ts_list = body.get("ts_list")
+        if isinstance(ts_list, list) and ts_list:
+            np.asarray(ts_list, dtype=np.int64)   # OverflowError past int64, like _int64 above
+        ts_list_json = orjson.dumps(ts_list).decode() if ts_list is not None else None
+    except (ValueError, TypeError, OverflowError):   # orjson.JSONEncodeError is a TypeError
+        return None, None, [], "bad-fields"
+    stats = []   # optional tables below, committed with the upload row by enqueue_upload()
+    # ---- Device events (optional, best-effort) ----
+    evs = body.get("events")
+    if isinstance(evs, list) and evs:
+        stats.append(("EVT", EVENT_INSERT_SQL, [(dev, now_ms, str(e)) for e in evs]))
+
+    # --- Power stats (optional, device-added) ---
+    ps = body.get("power_stats")
+    if isinstance(ps, dict):
+        try:
+            t_sleep  = _int64(ps.get("t_sleep_ms") or 0)          # total sleep (manual + auto)
+            t_manual = _int64(ps.get("t_manual_sleep_ms") or 0)   # manual light-sleep
+            t_auto   = _int64(ps.get("t_auto_sleep_ms") or 0)     # auto light-sleep (estimated)
+            t_uplink = _int64(ps.get("t_uplink_ms") or 0)
+            ubytes   = _int64(ps.get("uplink_bytes") or 0)
+            idle_b   = _int64(ps.get("idle_budget_ms") or 0)
+            stats.append(("PWR", POWER_INSERT_SQL, [(dev, now_ms, t_sleep, t_manual, t_auto, t_uplink, ubytes, idle_b)]))
+            logger.info("[PWR] dev=%s idle=%dms sleep=%dms (manual=%dms auto=%dms) uplink=%dms bytes=%d",
+                        dev, idle_b, t_sleep, t_manual, t_auto, t_uplink, ubytes)
+        except Exception as e:
+            logger.warning("[PWR] bad power_stats: %s", e)
+
+    # --- Diagnostic counters (buffer/transport visibility) ---
+    diag = body.get("diag")
+    if isinstance(diag, dict):
+        try:
+            dropped = _int64(diag.get("dropped_samples") or 0)
+            acqf = _int64(diag.get("acq_failures") or 0)
+            tf = _int64(diag.get("transport_failures") or 0)
+            stats.append(("DIAG", DIAG_INSERT_SQL, [(dev, now_ms, dropped, acqf, tf)]))
+        except Exception as e:
+            logger.warning("[DIAG] bad diag: %s", e)
+
+    # --------- Store upload (with decoded rows cached for the admin views) ---------
+    rows, note = decode_delta_rle_v1(blob, order) if codec == "delta_rle_v1" else ([], "unsupported")
+    params = (dev, ts0, ts1, seq, codec, order_json, ts_list_json, orig_samples, orig_bytes,
+              now_ms, blob, _pack_rows(rows) if note == "ok" else None)
+    return params, stats, rows, note
+
 @app.post("/api/device/upload")
 def device_upload():
     # print("**********AUTH HEADER:", request.headers.get("Authorization"))
 
     if not _auth_ok(request.headers.get("Authorization")):
         print("⚠️ Unauthorized request")
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+        return _json_response({"ok": False, "error": "unauthorized"}, 401)
 
-    raw = request.get_json(force=True, silent=True)
+    try:
+        raw = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        raw = None
     if not isinstance(raw, dict):
-        return jsonify({"ok": False, "error": "invalid-json"}), 400
+        return _json_response({"ok": False, "error": "invalid-json"}, 400)
 
     inner = _try_unwrap_envelope(raw)
     if inner is None:
-        return jsonify(_wrap_envelope({"error": "bad-mac-or-nonce"})), 400
+        return _json_response(_wrap_envelope({"error": "bad-mac-or-nonce"}), 400)
 
     body = inner
     # --- after `body = inner` validations and before preparing reply ---
@@ -639,7 +1170,7 @@ def device_upload():
                 # Only remove artifacts if manifest exists and matches the version we served to this device
                 if os.path.exists(man_path) and dev in LAST_FOTA:
                     try:
-                        mf = json.loads(open(man_path, "r").read())
+                        mf = _read_json(man_path)
                     except Exception:
                         mf = None
                     served = LAST_FOTA.get(dev, {})
@@ -653,7 +1184,7 @@ def device_upload():
                         # Update progress to 100% since boot_ok confirms completion
                         upsert_progress(dev, mf_ver, mf_size, mf_size, status="boot_ok")
                         # safe to delete manifest + chunks for this manifest
-                        cleanup_fota_files(version=mf_ver, reason="boot_ok")
+                        cleanup_fota_files(version=mf_ver, reason="boot_ok", background=True)
                         # remove LAST_FOTA for this device
                         if dev in LAST_FOTA:
                             del LAST_FOTA[dev]
@@ -689,96 +1220,29 @@ def device_upload():
         except Exception as e:
             print(f"[SIM-FAULT] insert error: {e}", flush=True)
 
-    for f in ("device_id","ts_start","ts_end","codec","order","block_b64"):
-        if f not in body:
-            return jsonify(_wrap_envelope({"error": "missing-fields"})), 400
-
+    now_ms = int(time.time() * 1000)
+    params, stats, rows, note = _prepare_upload(body, now_ms)
+    if params is None:
+        return _json_response(_wrap_envelope({"error": note}), 400)
     try:
-        blob = base64.b64decode(body["block_b64"], validate=True)
-    except Exception:
-        return jsonify(_wrap_envelope({"error": "bad-base64"})), 400
-
-    dev   = str(body["device_id"])
-    ts0   = int(body["ts_start"])
-    ts1   = int(body["ts_end"])
-    seq   = int(body.get("seq", 0))
-    codec = str(body["codec"])
+        rowid = await_upload(enqueue_upload(params, stats))
+    except Exception as e:   # writer down, stuck past UPLOAD_WAIT_S, or this row failed to insert
+        logger.error("[UPLOAD] store failed for dev=%s seq=%d: %r", params[0], params[3], e)
+        return _json_response(_wrap_envelope({"error": "store-unavailable"}), 503)
+    dev, ts0, ts1, seq, codec = params[:5]
     order = list(body["order"])
     ts_list = body.get("ts_list")
-    now_ms = int(time.time() * 1000)
-    # ---- Device events (optional, best-effort) ----
-    evs = body.get("events")
-    if isinstance(evs, list) and evs:
-        try:
-            db = get_db()
-            db.executemany(
-                "INSERT INTO device_events(device, received_at, event) VALUES(?,?,?)",
-                [(dev, now_ms, str(e)) for e in evs]
-            )
-            db.commit()
-        except Exception as e:
-            print(f"[EVT] insert error: {e}", flush=True)
-
-    # --- Power stats (optional, device-added) ---
-    ps = body.get("power_stats")
-    if isinstance(ps, dict):
-        try:
-            t_sleep  = int(ps.get("t_sleep_ms") or 0)          # total sleep (manual + auto)
-            t_manual = int(ps.get("t_manual_sleep_ms") or 0)   # manual light-sleep
-            t_auto   = int(ps.get("t_auto_sleep_ms") or 0)     # auto light-sleep (estimated)
-            t_uplink = int(ps.get("t_uplink_ms") or 0)
-            ubytes   = int(ps.get("uplink_bytes") or 0)
-            idle_b   = int(ps.get("idle_budget_ms") or 0)
-            db = get_db()
-            db.execute(
-                "INSERT INTO power_stats(device, received_at, t_sleep_ms, t_manual_sleep_ms, t_auto_sleep_ms, t_uplink_ms, uplink_bytes, idle_budget_ms) VALUES(?,?,?,?,?,?,?,?)",
-                (dev, now_ms, t_sleep, t_manual, t_auto, t_uplink, ubytes, idle_b)
-            )
-            db.commit()
-            print(f"[PWR] dev={dev} idle={idle_b}ms sleep={t_sleep}ms (manual={t_manual}ms auto={t_auto}ms) uplink={t_uplink}ms bytes={ubytes}", flush=True)
-        except Exception as e:
-            print(f"[PWR] insert error: {e}", flush=True)
 
-    # --- Diagnostic counters (buffer/transport visibility) ---
-    diag = body.get("diag")
-    if isinstance(diag, dict):
-        try:
-            dropped = int(diag.get("dropped_samples") or 0)
-            acqf = int(diag.get("acq_failures") or 0)
-            tf = int(diag.get("transport_failures") or 0)
-            db = get_db()
-            db.execute(
-                "INSERT INTO buffer_stats(device, received_at, dropped_samples, acq_failures, transport_failures) VALUES(?,?,?,?,?)",
-                (dev, now_ms, dropped, acqf, tf)
-            )
-            db.commit()
-        except Exception as e:
-            print(f"[DIAG] insert error: {e}", flush=True)
-
-    # --------- Store upload ---------
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("""INSERT INTO uploads
-                   (device_id, ts_start, ts_end, seq, codec, order_json, ts_list_json,
-                    orig_samples, orig_bytes, received_at, block)
-                   VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
-                (dev, ts0, ts1, seq, codec, json.dumps(order),
-                 json.dumps(ts_list) if ts_list is not None else None,
-                 body.get("orig_samples"), body.get("orig_bytes"),
-                 now_ms, blob))
-    db.commit()
-    rowid = cur.lastrowid
-
-    # Console print per-sample with SCALING
-    if codec == "delta_rle_v1":
-        rows, _ = decode_delta_rle_v1(blob, order)
+    # Console print per-sample with SCALING (LOG_LEVEL=DEBUG only)
+    if codec == "delta_rle_v1" and logger.isEnabledFor(logging.DEBUG):
         n = len(rows)
         dev_ms_list = _device_ms_list(n, ts0, ts1)
         epoch_ms_list = _epoch_ms_list(n, ts0, ts1, now_ms, ts_list if isinstance(ts_list, list) else None)
         for i in range(n):
             t_local = datetime.datetime.fromtimestamp(epoch_ms_list[i]/1000.0).strftime("%Y-%m-%d %H:%M:%S")
-            scaled  = _fmt_row(order, rows[i])
-            print(f"[DECODE] {t_local} dev={dev} dev_ms={dev_ms_list[i]}  {scaled}", flush=True)
+            logger.debug("[DECODE] %s dev=%s dev_ms=%s  %s", t_local, dev, dev_ms_list[i], _fmt_row(order, rows[i]))
+    else:
+        logger.info("[DECODE] dev=%s seq=%d samples=%d (%s)", dev, seq, len(rows), note)
 
     # --------- Prepare cloud → device reply ---------
     pathlib.Path(LOG_DIR).mkdir(parents=True, exist_ok=True)
@@ -792,14 +1256,14 @@ def device_upload():
     man_path = os.path.join(LOG_DIR, "fota_manifest.json")
     if os.path.exists(man_path):
         try:
-            mf = json.loads(open(man_path, "r").read())
+            mf = _read_json(man_path)
             manifest_version = mf.get('version', '')
             
             # Success case: device booted new version
             if device_fw_version and device_fw_version == manifest_version and manifest_version:
                 print(f"[FOTA] SUCCESS: {dev} booted version {manifest_version}", flush=True)
                 log_fota(dev, "success", f"version={manifest_version}")
-                cleanup_fota_files(version=manifest_version, reason="success")
+                cleanup_fota_files(version=manifest_version, reason="success", background=True)
             
             # Failure case: device reports corruption/rollback
             elif fota_failure:
@@ -807,7 +1271,7 @@ def device_upload():
                 failed_version = fota_failure.get("version", "")
                 print(f"[FOTA] FAILURE: {dev} {failure_reason} version={failed_version}", flush=True)
                 log_fota(dev, "failure", f"reason={failure_reason} version={failed_version}")
-                cleanup_fota_files(version=failed_version, reason="failure")
+                cleanup_fota_files(version=failed_version, reason="failure", background=True)
         except Exception as e:
             print(f"[FOTA] Error during success/failure check: {e}", flush=True)
 
@@ -818,7 +1282,7 @@ def device_upload():
     
     if os.path.exists(cfg_path):
         try:
-            cu = json.loads(open(cfg_path, "r").read())
+            cu = _read_json(cfg_path)
             
             # Check if security test mode is enabled (for testing device security)
             if os.path.exists(test_mode_path):
@@ -859,7 +1323,7 @@ def device_upload():
                 reply["config_update"] = cu
                 print(f"[QUEUE] Sent config_update -> {cu}", flush=True)
             
-            os.remove(cfg_path)
+            _remove_json(cfg_path)
         except Exception as e:
             print("[API] bad config_update:", e)
 
@@ -867,9 +1331,9 @@ def device_upload():
     cmd_path = os.path.join(LOG_DIR, "command.json")
     if os.path.exists(cmd_path):
         try:
-            cmd = json.loads(open(cmd_path, "r").read())
+            cmd = _read_json(cmd_path)
             reply["command"] = cmd
-            os.remove(cmd_path)
+            _remove_json(cmd_path)
             print(f"[QUEUE] Sent command -> {cmd}", flush=True)
         except Exception as e:
             print("[API] bad command:", e)
@@ -878,7 +1342,7 @@ def device_upload():
     man_path = os.path.join(LOG_DIR, "fota_manifest.json")
     if os.path.exists(man_path):
         try:
-            mf = json.loads(open(man_path, "r").read())
+            mf = _read_json(man_path)
             mf_version = mf.get('version')
             
             # Check if we already served this manifest to this device
@@ -982,7 +1446,50 @@ def device_upload():
         except Exception as e:
             print(f"[TEST] Warning: Could not delete test flag: {e}", flush=True)
 
-    return jsonify(_wrap_envelope(reply)), 200
+    return _json_response(_wrap_envelope(reply))
+
+@app.post("/api/device/upload_batch")
+def device_upload_batch():
+    """Backlog flush: {"uploads": [envelope, ...]}, with the valid items committed in one writer
+    transaction and a per-item id or error in the reply. Telemetry and stats only; FOTA/sim-fault reports and the cloud → device reply
+    stay on /api/device/upload."""
+    if not _auth_ok(request.headers.get("Authorization")):
+        logger.warning("⚠️ Unauthorized request")
+        return _json_response({"ok": False, "error": "unauthorized"}, 401)
+
+    try:
+        raw = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        raw = None
+    items = raw.get("uploads") if isinstance(raw, dict) else None
+    if not isinstance(items, list):
+        return _json_response({"ok": False, "error": "invalid-json"}, 400)
+    if len(items) > UPLOAD_BATCH_MAX:   # keep one request within one writer transaction
+        return _json_response({"ok": False, "error": "too-many", "max": UPLOAD_BATCH_MAX}, 413)
+
+    now_ms = int(time.time() * 1000)
+    # validate and decode everything first, then hand the valid uploads to the writer as one queue entry
+    results, queued = [], []
+    for item in items:
+        body = _try_unwrap_envelope(item) if isinstance(item, dict) else None
+        if body is None:
+            results.append({"error": "bad-mac-or-nonce"}); continue
+        params, stats, rows, note = _prepare_upload(body, now_ms)
+        if params is None:
+            results.append({"error": note}); continue
+        results.append(len(queued))
+        queued.append((params, stats))
+        logger.info("[DECODE] dev=%s seq=%d samples=%d (%s) [batch]", params[0], params[3], len(rows), note)
+    futs = enqueue_uploads(queued) if queued else []
+    deadline = time.monotonic() + UPLOAD_WAIT_S
+    for i, r in enumerate(results):
+        if isinstance(r, dict): continue
+        try:
+            results[i] = {"id": await_upload(futs[r], max(0.0, deadline - time.monotonic()))}
+        except Exception as e:   # only this item; the others keep their ids
+            logger.error("[UPLOAD] batch item %d store failed: %r", i, e)
+            results[i] = {"error": "store-unavailable"}
+    return _json_response(_wrap_envelope({"results": results}))
 
 # ---- FOTA: Independent chunk download endpoint ----
 @app.get("/api/fota/chunk")
@@ -996,21 +1503,23 @@ def fota_chunk():
     chunk_num_str = request.args.get("chunk", "")
     
     if not dev or not chunk_num_str:
-        return jsonify({"error": "missing device or chunk"}), 400
+        return _json_response({"error": "missing device or chunk"}, 400)
     
     try:
         chunk_num = int(chunk_num_str)
     except ValueError:
-        return jsonify({"error": "invalid chunk number"}), 400
+        return _json_response({"error": "invalid chunk number"}, 400)
     
     # Check if chunk file exists
     p = os.path.join(LOG_DIR, f"fota_chunk_{chunk_num:04d}.b64")
-    if not os.path.exists(p):
-        return jsonify({"error": f"chunk {chunk_num} not found"}), 404
+    try:
+        st = os.stat(p)
+    except OSError:
+        return _json_response({"error": f"chunk {chunk_num} not found"}, 404)
     
-    # Read and serve chunk
+    # Serve chunk (every device in a rollout asks for the same files; keep them in RAM)
     try:
-        data = open(p, "r").read().strip()
+        data = _chunk_b64(p, (st.st_mtime_ns, st.st_size, st.st_ino))
         
         # Track in LAST_FOTA for monitoring
         if dev not in LAST_FOTA:
@@ -1023,34 +1532,44 @@ def fota_chunk():
         print(f"[FOTA] Chunk {chunk_num:04d} served to {dev} (independent request)", flush=True)
         log_fota(dev, "chunk_served_independent", f"chunk={chunk_num}")
         
-        return jsonify({
+        return _json_response({
             "chunk_number": chunk_num,
             "data": data
-        }), 200
+        })
     except Exception as e:
         print(f"[FOTA] Error serving chunk {chunk_num}: {e}", flush=True)
-        return jsonify({"error": f"failed to read chunk: {e}"}), 500
+        return _json_response({"error": f"failed to read chunk: {e}"}, 500)
+
+# ---- Admin + summary API queries: short-lived row cache so polled pages don't contend with the writer ----
+_ADMIN_ROWS: dict = {}
+
+def _admin_rows(sql: str, params: tuple = ()) -> list:
+    now = time.monotonic()
+    hit = _ADMIN_ROWS.get((sql, params))
+    if hit is not None and now - hit[0] < ADMIN_CACHE_S:
+        return hit[1]
+    rows = get_db().execute(sql, params).fetchall()
+    if len(_ADMIN_ROWS) >= 256:
+        _ADMIN_ROWS.clear()
+    _ADMIN_ROWS[(sql, params)] = (now, rows)
+    return rows
 
 # ---- Admin: list + detail (with SCALED column) ----
 @app.get("/admin")
 def admin_home():
-    cur = get_db().cursor()
-    cur.execute("SELECT id, device_id, ts_start, ts_end, codec, received_at FROM uploads ORDER BY id DESC LIMIT 50")
-    rows = cur.fetchall()
+    rows = _admin_rows("SELECT id, device_id, ts_start, ts_end, codec, received_at FROM uploads ORDER BY id DESC LIMIT 50")
     out = [HTML_HEAD, "<h2>Recent uploads</h2><table class='table'><tr><th>ID</th><th>Device</th><th>Dev ms</th><th>Codec</th><th>Received (server)</th></tr>"]
     for (id_, dev, ts0, ts1, codec, recv) in rows:
         recvt = datetime.datetime.fromtimestamp(recv/1000.0).strftime("%Y-%m-%d %H:%M:%S")
         out.append(f"<tr><td><a href='/admin/upload/{id_}'>{id_}</a></td>"
-                   f"<td>{dev}</td><td>{ts0} → {ts1}</td><td>{codec}</td><td>{recvt}</td></tr>")    
+                   f"<td>{dev}</td><td>{ts0} → {ts1}</td><td>{codec}</td><td>{recvt}</td></tr>")
     out.append("</table>" + HTML_TAIL)
     return Response("".join(out), mimetype="text/html")
 
 @app.get("/admin/uploads")
 def admin_uploads():
-    cur = get_db().cursor()
-    cur.execute("""SELECT id, device_id, ts_start, ts_end, codec, received_at 
+    rows = _admin_rows("""SELECT id, device_id, ts_start, ts_end, codec, received_at 
                    FROM uploads ORDER BY id DESC LIMIT 200""")
-    rows = cur.fetchall()
     out = [HTML_HEAD, "<h2>Recent Data Uploads</h2>"]
     out.append("<table class='table'>")
     out.append("<tr><th>ID</th><th>Device</th><th>Time Range</th><th>Codec</th><th>Received</th></tr>")
@@ -1071,19 +1590,19 @@ def admin_uploads():
 def admin_view(rowid: int):
     cur = get_db().cursor()
     cur.execute("""SELECT device_id, ts_start, ts_end, seq, codec, order_json, ts_list_json,
-                          orig_samples, orig_bytes, received_at, block
+                          orig_samples, orig_bytes, received_at, block, decoded_json
                    FROM uploads WHERE id=?""", (rowid,))
     row = cur.fetchone()
     if not row:
         return Response(HTML_HEAD + "<h3>Not found</h3>" + HTML_TAIL, mimetype="text/html")
-    dev, ts0, ts1, seq, codec, order_json, ts_list_json, orig_samples, orig_bytes, recv, blob = row
-    order = json.loads(order_json)
-    ts_list = json.loads(ts_list_json) if ts_list_json else None
+    dev, ts0, ts1, seq, codec, order_json, ts_list_json, orig_samples, orig_bytes, recv, blob, cached = row
+    order = orjson.loads(order_json)
+    ts_list = orjson.loads(ts_list_json) if ts_list_json else None
     recv_h = datetime.datetime.fromtimestamp(recv/1000.0).strftime("%Y-%m-%d %H:%M:%S")
 
     rows = []; note = ""
     if codec == "delta_rle_v1":
-        rows, note = decode_delta_rle_v1(blob, order)
+        rows, note = _decoded_rows(get_db(), rowid, codec, blob, order, cached)
 
     out = [HTML_HEAD, "<h2>Upload detail</h2><pre class='mono'>"]
     out.append(f"Upload ID      : {rowid}\n")
@@ -1098,7 +1617,7 @@ def admin_view(rowid: int):
     out.append(f"\n[Decoded {len(rows)} samples — ok{' | using ts_list' if ts_list else ''}]\n")
     out.append("</pre>")
 
-    if rows:
+    if len(rows):
         out.append("<table class='table'><tr><th>#</th><th>dev_ms</th><th>time</th><th>raw</th><th>scaled</th></tr>")
         n = len(rows)
         dev_ms_list = _device_ms_list(n, ts0, ts1)
@@ -1110,13 +1629,10 @@ def admin_view(rowid: int):
                        f"<td>{_fmt_row(order, raw)}</td></tr>")
         out.append("</table>")
 
-    # hex dump
-    hexrows = []
-    for i in range(0, len(blob), 16):
-        chunk = blob[i:i+16]
-        hexrows.append(f"{i:04X}: " + " ".join(f"{x:02X}" for x in chunk))
+    # hex dump: one C-level hex conversion, then 16-byte (47-char) slices
+    hx = blob.hex(" ").upper()
     out.append("<h3>Compressed block (hex dump)</h3><pre class='mono'>")
-    out.append("\n".join(hexrows))
+    out.append("\n".join(f"{i:04X}: {hx[i*3:i*3+47]}" for i in range(0, len(blob), 16)))
     out.append("</pre>" + HTML_TAIL)
     return Response("".join(out), mimetype="text/html")
 
@@ -1124,20 +1640,37 @@ def admin_view(rowid: int):
 @app.get("/api/upload/<int:rowid>.json")
 def api_decoded(rowid: int):
     cur = get_db().cursor()
-    cur.execute("SELECT device_id, ts_start, ts_end, codec, order_json, ts_list_json, received_at, block FROM uploads WHERE id=?", (rowid,))
+    cur.execute("SELECT device_id, ts_start, ts_end, codec, order_json, ts_list_json, received_at, block, decoded_json FROM uploads WHERE id=?", (rowid,))
     row = cur.fetchone()
-    if not row: return jsonify({"ok": False, "error": "not-found"}), 404
-    dev, ts0, ts1, codec, order_json, ts_list_json, recv, blob = row
-    order = json.loads(order_json)
-    ts_list = json.loads(ts_list_json) if ts_list_json else None
+    if not row: return _json_response({"ok": False, "error": "not-found"}, 404)
+    dev, ts0, ts1, codec, order_json, ts_list_json, recv, blob, cached = row
+    order = orjson.loads(order_json)
+    ts_list = orjson.loads(ts_list_json) if ts_list_json else None
 
-    rows, note = decode_delta_rle_v1(blob, order) if codec=="delta_rle_v1" else ([], "unsupported")
-    scaled = [_fmt_row(order, r) for r in rows]
+    rows, note = _decoded_rows(get_db(), rowid, codec, blob, order, cached)
     n = len(rows)
     device_ms = _device_ms_list(n, ts0, ts1)
     times_ms  = _epoch_ms_list(n, ts0, ts1, recv, ts_list)
 
-    return jsonify({
+    if request.args.get("fmt") == "raw":
+        # samples as one little-endian uint16 blob: no per-value ints or scaled strings
+        arr = np.asarray(rows, dtype="<u2").reshape(n, len(order))
+        return _json_response({
+            "ok": True,
+            "device_id": dev,
+            "codec": codec,
+            "order": order,
+            "rows_raw_b64": base64.b64encode(arr.tobytes()).decode("ascii"),
+            "dtype": "<u2",
+            "shape": [n, len(order)],
+            "device_ms": device_ms,
+            "times_ms": times_ms,
+            "decode_note": note,
+            "received_at_ms": recv
+        })
+
+    scaled = [_fmt_row(order, r) for r in rows]
+    return _json_response({
         "ok": True,
         "device_id": dev,
         "codec": codec,
@@ -1182,18 +1715,17 @@ def api_fota_progress():
 
 @app.get("/admin/fota")
 def admin_fota():
-    db = get_db()
-    prog = db.execute("""
+    prog = _admin_rows("""
       SELECT device, version, size, written, percent, status, updated
       FROM fota_progress
       ORDER BY updated DESC
-    """).fetchall()
-    events = db.execute("""
+    """)
+    events = _admin_rows("""
       SELECT ts, device, kind, detail
       FROM fota_events
       ORDER BY ts DESC, id DESC
       LIMIT 200
-    """).fetchall()
+    """)
 
     out = [HTML_HEAD, "<h2>🔄 FOTA – Live Progress</h2>"]
     out.append("""
@@ -1469,27 +2001,26 @@ def admin_fota():
 
 @app.get("/admin/fota/<device>")
 def admin_fota_device(device: str):
-    db = get_db()
-    prog = db.execute("""
+    prog = next(iter(_admin_rows("""
       SELECT device, version, size, written, percent, status, updated
       FROM fota_progress WHERE device=?
-    """, (device,)).fetchone()
-    events = db.execute("""
+    """, (device,))), None)
+    events = _admin_rows("""
       SELECT ts, device, kind, detail
       FROM fota_events
       WHERE device=?
       ORDER BY ts DESC, id DESC
       LIMIT 500
-    """, (device,)).fetchall()
+    """, (device,))
     
     # Get version history
-    versions = db.execute("""
+    versions = _admin_rows("""
       SELECT version, size, status, created_at, updated_at
       FROM fota_versions
       WHERE device=?
       ORDER BY updated_at DESC
       LIMIT 50
-    """, (device,)).fetchall()
+    """, (device,))
 
     out = [HTML_HEAD, f"<h2>FOTA – {device}</h2>"]
     out.append("<h3>Current progress</h3>")
@@ -1545,7 +2076,7 @@ def admin_fota_cleanup():
     if not os.path.exists(man_path):
         return jsonify({"ok": False, "error": "no-manifest"}), 404
     try:
-        mf = json.loads(open(man_path, "r").read())
+        mf = _read_json(man_path)
     except Exception as e:
         return jsonify({"ok": False, "error": "bad-manifest", "detail": str(e)}), 400
     mf_ver = mf.get("version")
@@ -1553,15 +2084,16 @@ def admin_fota_cleanup():
         return jsonify({"ok": False, "error": "version-mismatch", "manifest_version": mf_ver}), 400
     # delete manifest + chunks
     try:
-        os.remove(man_path)
+        _remove_json(man_path)
     except Exception:
         pass
     removed = 0
-    for p in glob.glob(os.path.join(LOG_DIR, "fota_chunk_*.b64")):
+    for p in _fota_chunk_paths():
         try:
             os.remove(p); removed += 1
         except Exception:
             pass
+    _chunk_b64.cache_clear()
     return jsonify({"ok": True, "removed_chunks": removed, "manifest_version": mf_ver})
 
 @app.get("/admin/fota/upload")
@@ -1742,6 +2274,7 @@ def api_fota_upload():
         
         # Create logs directory if needed
         os.makedirs(LOG_DIR, exist_ok=True)
+        _wait_fota_cleanup()   # a pending boot_ok cleanup must not delete the new chunks
         
         # Write manifest (with possibly corrupted hash)
         manifest = {
@@ -1751,8 +2284,7 @@ def api_fota_upload():
             "chunk_size": chunk_size
         }
         man_path = os.path.join(LOG_DIR, "fota_manifest.json")
-        with open(man_path, "w") as f:
-            json.dump(manifest, f)
+        _atomic_write_bytes(man_path, orjson.dumps(manifest))
         
         # Generate and write chunks (always from real binary)
         num_chunks = 0
@@ -1766,6 +2298,7 @@ def api_fota_upload():
                 f.write(chunk_b64)
             
             num_chunks += 1
+        _chunk_b64.cache_clear()   # drop the previous image's chunks
         
         # Log in database
         if is_bad:
@@ -2192,31 +2725,52 @@ def admin_sim_fault_device(device: str):
     """
     return Response(html, mimetype="text/html")
 
+# admin table rows: one str.format per row, filled straight from the query tuples
+_POWER_SUMMARY_ROW = ("<tr><td><a href='/admin/power/{0}'>{0}</a></td>"
+                      "<td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td><td>{6}</td></tr>")
+_POWER_RECENT_ROW  = "<tr><td>{1}</td><td>{0}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td></tr>"
+_POWER_DEVICE_ROW  = "<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td></tr>"
+_BUFFER_ROW        = "<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>"
+_EVENT_ROW         = "<tr><td>{0}</td><td><a href='/admin/events/{1}'>{1}</a></td><td class='mono'>{2}</td></tr>"
+_EVENT_DEVICE_ROW  = "<tr><td>{0}</td><td class='mono'>{1}</td></tr>"
+
+def _stream_table(head: str, sql: str, params: tuple, row_tmpl: str, batch: int = 200) -> Response:
+    """Table page streamed like admin_home: head first, then rows in fetchmany batches off the cursor"""
+    def gen():
+        yield head
+        cur = get_db().execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows: break
+            yield "".join([row_tmpl.format(*r) for r in rows])
+        yield "</table>" + HTML_TAIL
+    return Response(stream_with_context(gen()), mimetype="text/html")
+
 @app.get("/admin/power")
 def admin_power():
-    db = get_db()
     # Summary by device (recent averages)
-    summary = db.execute("""
+    summary = _admin_rows("""
        SELECT device,
             COUNT(*)                    AS n,
-            ROUND(AVG(idle_budget_ms),1) AS avg_idle_ms,
-            ROUND(AVG(t_sleep_ms), 1)     AS avg_sleep_ms,
-            ROUND(AVG(t_uplink_ms), 1)    AS avg_uplink_ms,
-            ROUND(AVG(uplink_bytes), 1)   AS avg_bytes,
-            MAX(received_at)              AS last_recv
+            printf('%.1f', AVG(idle_budget_ms)) AS avg_idle_ms,
+            printf('%.1f', AVG(t_sleep_ms))     AS avg_sleep_ms,
+            printf('%.1f', AVG(t_uplink_ms))    AS avg_uplink_ms,
+            printf('%.1f', AVG(uplink_bytes))   AS avg_bytes,
+            COALESCE(strftime('%Y-%m-%d %H:%M:%S', MAX(received_at)/1000, 'unixepoch', 'localtime'), '-') AS last_h
         FROM power_stats
         GROUP BY device
-        ORDER BY last_recv DESC
+        ORDER BY MAX(received_at) DESC
 
-    """).fetchall()
+    """)
 
     # Recent raw rows (last 200)
-    recent = db.execute("""
-        SELECT device, received_at,idle_budget_ms, t_sleep_ms, t_uplink_ms, uplink_bytes
+    recent = _admin_rows("""
+        SELECT device, strftime('%Y-%m-%d %H:%M:%S', received_at/1000, 'unixepoch', 'localtime'),
+               idle_budget_ms, t_sleep_ms, t_uplink_ms, uplink_bytes
         FROM power_stats
         ORDER BY received_at DESC
         LIMIT 200
-    """).fetchall()
+    """)
 
     out = [HTML_HEAD, "<h2>Power – Summary by Device</h2>"]
     out.append(
@@ -2226,44 +2780,35 @@ def admin_power():
         "</tr>"
     )
 
-    for dev, n, avg_idle,avg_sl, avg_ul, avg_b, last_ms in summary:
-        last_h = datetime.datetime.fromtimestamp(last_ms/1000.0).strftime("%Y-%m-%d %H:%M:%S") if last_ms else "-"
-        out.append(f"<tr><td><a href='/admin/power/{dev}'>{dev}</a></td>"
-               f"<td>{n}</td><td>{avg_idle}</td><td>{avg_sl}</td><td>{avg_ul}</td><td>{avg_b}</td><td>{last_h}</td></tr>")
+    out.append("".join([_POWER_SUMMARY_ROW.format(*r) for r in summary]))
     out.append("</table>")
 
     out.append("<h2>Recent Entries</h2>")
     out.append("<table class='table'><tr><th>Time</th><th>Device</th><th>Idle (ms)</th><th>Sleep (ms)</th><th>Uplink (ms)</th><th>Bytes</th></tr>")
-    for dev, rcv, idle, sl, ul, b in recent:
-        rcv_h = datetime.datetime.fromtimestamp(rcv/1000.0).strftime("%Y-%m-%d %H:%M:%S")
-        out.append(f"<tr><td>{rcv_h}</td><td>{dev}</td><td>{idle}</td><td>{sl}</td><td>{ul}</td><td>{b}</td></tr>")
+    out.append("".join([_POWER_RECENT_ROW.format(*r) for r in recent]))
     out.append("</table>" + HTML_TAIL)
     return Response("".join(out), mimetype="text/html")
 
 @app.get("/admin/power/<device>")
 def admin_power_device(device: str):
-    db = get_db()
-    rows = db.execute("""
-        SELECT received_at,idle_budget_ms, t_sleep_ms, t_uplink_ms, uplink_bytes
+    rows = _admin_rows("""
+        SELECT strftime('%Y-%m-%d %H:%M:%S', received_at/1000, 'unixepoch', 'localtime'),
+               idle_budget_ms, t_sleep_ms, t_uplink_ms, uplink_bytes
         FROM power_stats
         WHERE device=?
         ORDER BY received_at DESC
         LIMIT 500
-    """, (device,)).fetchall()
+    """, (device,))
 
     out = [HTML_HEAD, f"<h2>Power – {device}</h2>"]
     out.append("<table class='table'><tr><th>Time</th><th>Idle (ms)</th><th>Sleep (ms)</th><th>Uplink (ms)</th><th>Bytes</th></tr>")
-    # rows:
-    for rcv, idle, sl, ul, b in rows:
-        rcv_h = datetime.datetime.fromtimestamp(rcv/1000.0).strftime("%Y-%m-%d %H:%M:%S")
-        out.append(f"<tr><td>{rcv_h}</td><td>{idle}</td><td>{sl}</td><td>{ul}</td><td>{b}</td></tr>")
+    out.append("".join([_POWER_DEVICE_ROW.format(*r) for r in rows]))
     out.append("</table>" + HTML_TAIL)
     return Response("".join(out), mimetype="text/html")
 
 @app.get("/api/power/summary")
 def api_power_summary():
-    db = get_db()
-    rows = db.execute("""
+    rows = _admin_rows("""
         SELECT device,
             COUNT(*)               AS n,
             AVG(idle_budget_ms)    AS avg_idle_ms,
@@ -2276,7 +2821,7 @@ def api_power_summary():
         FROM power_stats
         GROUP BY device
         ORDER BY last_recv DESC
-    """).fetchall()
+    """)
 
     return jsonify([
         {"device": r[0], "samples": r[1], "avg_idle_ms": r[2],
@@ -2287,14 +2832,13 @@ def api_power_summary():
 
 @app.get("/api/power/<device>")
 def api_power_device(device: str):
-    db = get_db()
-    rows = db.execute("""
+    rows = _admin_rows("""
         SELECT received_at, idle_budget_ms, t_sleep_ms, t_manual_sleep_ms, t_auto_sleep_ms, t_uplink_ms, uplink_bytes
         FROM power_stats
         WHERE device=?
         ORDER BY received_at DESC
         LIMIT 1000
-    """, (device,)).fetchall()
+    """, (device,))
 
     return jsonify([
         {"received_at_ms": r[0], "idle_budget_ms": r[1],
@@ -2304,6 +2848,64 @@ def api_power_device(device: str):
     ])
 
 
+# PNG rendering is the slow part of a snapshot; one worker, since pyplot keeps global state
+_PLOT_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plot")
+_PLOT_JOBS: dict = {}    # png path -> Future, for /api/power/snapshot/status
+
+def _plot_status(fut: Future) -> str:
+    if not fut.done(): return "pending"
+    return "failed" if fut.exception() is not None else "ready"
+
+def _render_power_png(rows: list, base: str, png_path: str, dev: str, minutes: int) -> None:
+    # rows are the snapshot query tuples, newest first: one array, then column views in time order
+    arr = np.array(rows, dtype=np.int64)[::-1]
+    # local wall-clock x axis; fromtimestamp per sample so each point gets its own UTC offset (DST)
+    fromts = datetime.datetime.fromtimestamp
+    xs = [fromts(t / 1000.0) for t in arr[:, 0].tolist()]
+    idle_y, sleep_y, uplink_y = arr[:, 1], arr[:, 2], arr[:, 5]
+    plt = _plt()
+    fig, ax = plt.subplots(3, 1, figsize=(10,6), sharex=True)
+    ax[0].plot(xs, sleep_y, '-o', label='t_sleep_ms')
+    ax[0].legend(); ax[0].grid(True)
+    ax[1].plot(xs, uplink_y, '-o', label='t_uplink_ms', color='C1')
+    ax[1].legend(); ax[1].grid(True)
+    ax[2].plot(xs, idle_y, '-o', label='idle_budget_ms', color='C2')
+    ax[2].legend(); ax[2].grid(True)
+    fig.autofmt_xdate()
+    fig.suptitle(f"Power snapshot for {dev} (last {minutes} min)")
+    fig.tight_layout(rect=[0,0,1,0.96])
+    # compute energy estimate using env or defaults (mV, mA assumptions)
+    try:
+        V_mV = int(os.getenv('POWER_V_SUPPLY_MV') or os.getenv('ECOWATT_POWER_V_SUPPLY') or 5000)
+        I_active = int(os.getenv('POWER_I_ACTIVE_MA') or os.getenv('ECOWATT_POWER_I_ACTIVE_MA') or 200)
+        I_uplink = int(os.getenv('POWER_I_UPLINK_MA') or os.getenv('ECOWATT_POWER_I_UPLINK_MA') or 300)
+        I_sleep = int(os.getenv('POWER_I_SLEEP_MA') or os.getenv('ECOWATT_POWER_I_SLEEP_MA') or 5)
+        # compute totals (ms)
+        total_sleep_ms = int(sleep_y.sum())
+        total_uplink_ms = int(uplink_y.sum())
+        total_idle_ms = int(idle_y.sum())
+        # convert to seconds
+        s_sleep = total_sleep_ms/1000.0
+        s_uplink = total_uplink_ms/1000.0
+        s_idle = total_idle_ms/1000.0
+        # estimate energy (J) = V * I * t  (V in volts, I in A)
+        V = V_mV / 1000.0
+        E_sleep = V * (I_sleep/1000.0) * s_sleep
+        E_uplink = V * (I_uplink/1000.0) * s_uplink
+        E_idle = V * (I_active/1000.0) * s_idle
+        E_total = E_sleep + E_uplink + E_idle
+        est_text = f"Est energy: {E_total:.2f} J (sleep={E_sleep:.2f} J uplink={E_uplink:.2f} J idle={E_idle:.2f} J)"
+    except Exception:
+        est_text = "Est energy: n/a"
+    fig.savefig(png_path)
+    # write a small .meta.json alongside containing energy estimate
+    try:
+        _atomic_write_bytes(base + ".meta.json",
+                            orjson.dumps({"energy_estimate_j": E_total, "detail": est_text}, option=orjson.OPT_INDENT_2))
+    except Exception:
+        pass
+    plt.close(fig)
+
 @app.post("/api/power/snapshot")
 def api_power_snapshot():
     """Collect an N-minute snapshot for a device, save JSON/CSV/PNG in LOG_DIR and return paths.
@@ -2336,79 +2938,60 @@ def api_power_snapshot():
     csv_path = base + ".csv"
     png_path = base + ".png"
     # write json
-    open(json_path, "w").write(json.dumps(data, indent=2))
+    _atomic_write_bytes(json_path, orjson.dumps(data, option=orjson.OPT_INDENT_2))
     # write csv
     try:
         with open(csv_path, "w", newline='') as cf:
             w = csv.writer(cf)
             w.writerow(["received_at_ms", "idle_budget_ms", "t_sleep_ms", "t_manual_sleep_ms", "t_auto_sleep_ms", "t_uplink_ms", "uplink_bytes"])
-            for r in data:
-                w.writerow([r['received_at_ms'], r['idle_budget_ms'], r['t_sleep_ms'], r['t_manual_sleep_ms'], r['t_auto_sleep_ms'], r['t_uplink_ms'], r['uplink_bytes']])
+            w.writerows(rows)   # query tuples are already in column order
     except Exception as e:
         return jsonify({"ok": False, "error": "csv_write_failed", "detail": str(e)}), 500
-    # create PNG plot
-    try:
-        if data:
-            xs = [datetime.datetime.fromtimestamp(d['received_at_ms']/1000.0) for d in reversed(data)]
-            sleep_y = [d['t_sleep_ms'] for d in reversed(data)]
-            uplink_y = [d['t_uplink_ms'] for d in reversed(data)]
-            idle_y = [d['idle_budget_ms'] for d in reversed(data)]
-            fig, ax = plt.subplots(3, 1, figsize=(10,6), sharex=True)
-            ax[0].plot(xs, sleep_y, '-o', label='t_sleep_ms')
-            ax[0].legend(); ax[0].grid(True)
-            ax[1].plot(xs, uplink_y, '-o', label='t_uplink_ms', color='C1')
-            ax[1].legend(); ax[1].grid(True)
-            ax[2].plot(xs, idle_y, '-o', label='idle_budget_ms', color='C2')
-            ax[2].legend(); ax[2].grid(True)
-            fig.autofmt_xdate()
-            fig.suptitle(f"Power snapshot for {dev} (last {minutes} min)")
-            fig.tight_layout(rect=[0,0,1,0.96])
-            # compute energy estimate using env or defaults (mV, mA assumptions)
-            try:
-                V_mV = int(os.getenv('POWER_V_SUPPLY_MV') or os.getenv('ECOWATT_POWER_V_SUPPLY') or 5000)
-                I_active = int(os.getenv('POWER_I_ACTIVE_MA') or os.getenv('ECOWATT_POWER_I_ACTIVE_MA') or 200)
-                I_uplink = int(os.getenv('POWER_I_UPLINK_MA') or os.getenv('ECOWATT_POWER_I_UPLINK_MA') or 300)
-                I_sleep = int(os.getenv('POWER_I_SLEEP_MA') or os.getenv('ECOWATT_POWER_I_SLEEP_MA') or 5)
-                # compute totals (ms)
-                total_sleep_ms = sum(sleep_y)
-                total_uplink_ms = sum(uplink_y)
-                total_idle_ms = sum(idle_y)
-                # convert to seconds
-                s_sleep = total_sleep_ms/1000.0
-                s_uplink = total_uplink_ms/1000.0
-                s_idle = total_idle_ms/1000.0
-                # estimate energy (J) = V * I * t  (V in volts, I in A)
-                V = V_mV / 1000.0
-                E_sleep = V * (I_sleep/1000.0) * s_sleep
-                E_uplink = V * (I_uplink/1000.0) * s_uplink
-                E_idle = V * (I_active/1000.0) * s_idle
-                E_total = E_sleep + E_uplink + E_idle
-                est_text = f"Est energy: {E_total:.2f} J (sleep={E_sleep:.2f} J uplink={E_uplink:.2f} J idle={E_idle:.2f} J)"
-            except Exception:
-                est_text = "Est energy: n/a"
-            fig.savefig(png_path)
-            # write a small .meta.json alongside containing energy estimate
-            try:
-                open(base + ".meta.json", "w").write(json.dumps({"energy_estimate_j": E_total, "detail": est_text}, indent=2))
-            except Exception:
-                pass
-            plt.close(fig)
-    except Exception as e:
-        return jsonify({"ok": False, "error": "plot_failed", "detail": str(e)}), 500
-
-    return jsonify({"ok": True, "device": dev, "count": len(data), "json": json_path, "csv": csv_path, "png": png_path})
+    # PNG renders in the background; ?wait=1 keeps the old blocking behaviour
+    fut = None
+    if data:
+        fut = _PLOT_POOL.submit(_render_power_png, rows, base, png_path, dev, minutes)
+        _PLOT_JOBS[png_path] = fut
+        if len(_PLOT_JOBS) > 256:
+            for k in [k for k, f in _PLOT_JOBS.items() if f.done()]: _PLOT_JOBS.pop(k, None)
+    wait = request.args.get("wait", req.get("wait"))
+    wait = wait.strip().lower() in ("1", "true", "yes") if isinstance(wait, str) else bool(wait)   # "0"/"false" mean no
+    if fut is not None and wait:
+        try:
+            fut.result()
+        except Exception as e:
+            return jsonify({"ok": False, "error": "plot_failed", "detail": str(e)}), 500
+    png_status = "none" if fut is None else _plot_status(fut)
+
+    return jsonify({"ok": True, "device": dev, "count": len(data), "json": json_path, "csv": csv_path, "png": png_path,
+                    "png_status": png_status})
+
+@app.get("/api/power/snapshot/status")
+def api_power_snapshot_status():
+    """State of a snapshot's PNG: pending / ready / failed (or missing once the job record is gone)"""
+    png_path = request.args.get("png") or ""
+    name = os.path.basename(png_path)
+    if not (name.startswith("power_snapshot_") and name.endswith(".png")):
+        return jsonify({"ok": False, "error": "bad png path"}), 400
+    png_path = os.path.join(LOG_DIR, name)
+    fut = _PLOT_JOBS.get(png_path)
+    if fut is not None:
+        status = _plot_status(fut)
+        if status == "failed":
+            return jsonify({"ok": False, "png": png_path, "png_status": status, "detail": str(fut.exception())})
+        return jsonify({"ok": True, "png": png_path, "png_status": status})
+    return jsonify({"ok": True, "png": png_path, "png_status": "ready" if os.path.exists(png_path) else "missing"})
 
 
 @app.get("/api/buffer/<device>")
 def api_buffer_device(device: str):
-    db = get_db()
-    rows = db.execute("""
+    rows = _admin_rows("""
         SELECT received_at, dropped_samples, acq_failures, transport_failures
         FROM buffer_stats
         WHERE device=?
         ORDER BY received_at DESC
         LIMIT 1000
-    """, (device,)).fetchall()
+    """, (device,))
     return jsonify([
         {"received_at_ms": r[0], "dropped_samples": r[1], "acq_failures": r[2], "transport_failures": r[3]}
         for r in rows
@@ -2417,53 +3000,43 @@ def api_buffer_device(device: str):
 
 @app.get("/admin/buffer")
 def admin_buffer():
-    db = get_db()
-    summary = db.execute("""
-        SELECT device, COUNT(*) AS n, MAX(received_at) AS last_recv, SUM(dropped_samples) AS drops
+    summary = _admin_rows("""
+        SELECT device, COUNT(*) AS n, COALESCE(SUM(dropped_samples), 0) AS drops,
+               COALESCE(strftime('%Y-%m-%d %H:%M:%S', MAX(received_at)/1000, 'unixepoch', 'localtime'), '-') AS last_h
         FROM buffer_stats
         GROUP BY device
-        ORDER BY last_recv DESC
-    """).fetchall()
+        ORDER BY MAX(received_at) DESC
+    """)
     out = [HTML_HEAD, "<h2>Buffer – Summary by Device</h2>"]
     out.append("<table class='table'><tr><th>Device</th><th>Samples</th><th>Total Drops</th><th>Last Received</th></tr>")
-    for dev,n,drops,last in summary:
-        last_h = datetime.datetime.fromtimestamp(last/1000.0).strftime('%Y-%m-%d %H:%M:%S') if last else '-'
-        out.append(f"<tr><td>{dev}</td><td>{n}</td><td>{drops or 0}</td><td>{last_h}</td></tr>")
+    out.append("".join([_BUFFER_ROW.format(*r) for r in summary]))
     out.append("</table>" + HTML_TAIL)
     return Response("".join(out), mimetype="text/html")
 
 @app.get("/admin/events")
 def admin_events():
-    rows = get_db().execute("""
+    return _stream_table(HTML_HEAD + "<h2>Recent Device Events</h2>"
+                         "<table class='table'><tr><th>Time</th><th>Device</th><th>Event</th></tr>",
+                         """
       SELECT strftime('%Y-%m-%d %H:%M:%S', received_at/1000,'unixepoch'),
              device, event
       FROM device_events
       ORDER BY received_at DESC
       LIMIT 300
-    """).fetchall()
-    out=[HTML_HEAD, "<h2>Recent Device Events</h2>",
-         "<table class='table'><tr><th>Time</th><th>Device</th><th>Event</th></tr>"]
-    for t, d, e in rows:
-        out.append(f"<tr><td>{t}</td><td><a href='/admin/events/{d}'>{d}</a></td><td class='mono'>{e}</td></tr>")
-    out.append("</table>"+HTML_TAIL)
-    return Response("".join(out), mimetype="text/html")
+    """, (), _EVENT_ROW)
 
 @app.get("/admin/events/<device>")
 def admin_events_device(device: str):
-    rows = get_db().execute("""
+    return _stream_table(HTML_HEAD + f"<h2>Events – {device}</h2>"
+                         "<table class='table'><tr><th>Time</th><th>Event</th></tr>",
+                         """
       SELECT strftime('%Y-%m-%d %H:%M:%S', received_at/1000,'unixepoch'),
              event
       FROM device_events
       WHERE device=?
       ORDER BY received_at DESC
       LIMIT 1000
-    """, (device,)).fetchall()
-    out=[HTML_HEAD, f"<h2>Events – {device}</h2>",
-         "<table class='table'><tr><th>Time</th><th>Event</th></tr>"]
-    for t, e in rows:
-        out.append(f"<tr><td>{t}</td><td class='mono'>{e}</td></tr>")
-    out.append("</table>"+HTML_TAIL)
-    return Response("".join(out), mimetype="text/html")
+    """, (device,), _EVENT_DEVICE_ROW)
 
 @app.route("/admin/controls", methods=["GET","POST"])
 def admin_controls():
@@ -2475,12 +3048,12 @@ def admin_controls():
             si  = int(request.form.get("sampling_interval") or 0)
             regs = [r.strip() for r in (request.form.get("registers") or "").split(",") if r.strip()]
             obj = {"config_update": {"sampling_interval": si, "registers": regs}}
-            open(os.path.join(LOG_DIR, "config_update.json"), "w").write(json.dumps(obj))
+            _atomic_write_bytes(os.path.join(LOG_DIR, "config_update.json"), orjson.dumps(obj))
             msg = "queued config_update"
         elif kind == "command":
             val = int(request.form.get("export_percent") or 10)  # Default to 10% instead of 0%
             obj = {"command":{"action":"write_register","target_register":"status_flag","value":val}}
-            open(os.path.join(LOG_DIR, "command.json"), "w").write(json.dumps(obj))
+            _atomic_write_bytes(os.path.join(LOG_DIR, "command.json"), orjson.dumps(obj))
             msg = f"queued command (export={val}%)"
 
         return redirect(url_for("admin_controls") + f"?ok={msg}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Upload writer checks: batching, bad-row isolation, timeouts and writer death
+import os
+import base64
+import struct
+import tempfile
+import threading
+import time
+
+tmp = tempfile.mkdtemp()
+os.environ.setdefault("SQLITE_PATH", os.path.join(tmp, "test.db"))
+os.environ.setdefault("LOG_DIR", os.path.join(tmp, "logs"))
+
+import app
+
+ORDER = ["vac1", "iac1", "fac1", "vpv1", "vpv2", "ipv1", "ipv2", "temp", "export_percent", "pac"]
+
+# a 2-sample block: first values, then one delta per field
+BLOCK = bytes([1, len(ORDER)]) + struct.pack("<H", 2) + b"\0"*4 + b"\x10\x00"*len(ORDER) \
+        + b"\x01\x01\x00"*len(ORDER) + b"\0"*4
+
+def upload(seq):
+    body = {"device_id": "dev-test", "ts_start": 1000, "ts_end": 2000, "seq": seq, "codec": "delta_rle_v1",
+            "order": ORDER, "block_b64": base64.b64encode(BLOCK).decode(), "events": [f"e{seq}"]}
+    params, stats, rows, note = app._prepare_upload(body, 1_700_000_000_000)
+    assert params is not None and note == "ok", note
+    return params, stats
+
+def count(sql):
+    db = app.get_db()
+    return db.execute(sql).fetchone()[0]
+
+def outcome(fut):
+    try:
+        return fut.result(timeout=5)
+    except Exception as e:
+        return type(e).__name__
+
+# one queue entry -> consecutive rowids from a single transaction
+commits = []
+real_commit = app._commit_uploads
+app._commit_uploads = lambda conn, batch: commits.append(len(batch)) or real_commit(conn, batch)
+ids = [outcome(f) for f in app.enqueue_uploads([upload(i) for i in range(20)])]
+assert ids == list(range(ids[0], ids[0] + 20)), ids
+assert commits == [20], commits
+assert count("SELECT count(*) FROM device_events WHERE device='dev-test'") == 20
+print("✓ batch committed in one transaction")
+
+# an unbindable row fails alone; its batch-mates are retried one by one and commit
+good = upload(100)
+bad = (good[0][:8] + ([1],) + good[0][9:], good[1])   # orig_bytes=[1]: sqlite3 cannot bind a list
+commits.clear()
+res = [outcome(f) for f in app.enqueue_uploads([upload(101), bad, upload(102)])]
+assert isinstance(res[0], int) and isinstance(res[2], int) and res[1] == "ProgrammingError", res
+assert commits == [3, 1, 1, 1], commits
+assert count("SELECT count(*) FROM uploads WHERE seq IN (101, 102)") == 2
+print("✓ bad row isolated within its batch")
+app._commit_uploads = real_commit
+
+# a request that gave up is cancelled and never committed; one already taken is waited for
+gate = threading.Event()
+real_write = app._write_batch
+def gated_write(conn, batch):
+    gate.wait()
+    real_write(conn, batch)
+app._write_batch = gated_write
+taken = app.enqueue_upload(*upload(200))
+while not taken.running():
+    time.sleep(0.01)
+late = app.enqueue_upload(*upload(201))
+try:
+    app.await_upload(late, 0.2)
+    raise AssertionError("await_upload did not time out")
+except app.FutureTimeout:
+    pass
+assert late.cancelled()
+gate.set()
+assert isinstance(app.await_upload(taken), int)
+app._write_batch = real_write
+assert isinstance(outcome(app.enqueue_upload(*upload(202))), int)   # flushes the queue behind 201
+assert count("SELECT count(*) FROM uploads WHERE seq=201") == 0
+print("✓ timed-out upload skipped by the writer")
+
+# writer death fails the in-flight and queued futures, and the next enqueue starts a new writer
+def die(conn, batch):
+    raise SystemExit("connection lost")
+app._write_batch = die
+futs = [app.enqueue_upload(*upload(300))]
+futs += app.enqueue_uploads([upload(301), upload(302)])
+assert [outcome(f) for f in futs] == ["RuntimeError"]*3, [outcome(f) for f in futs]
+app._write_batch = real_write
+assert isinstance(outcome(app.enqueue_upload(*upload(303))), int)
+print("✓ writer death fails pending futures and the writer restarts")
+
+print("\n✓ Writer checks passed!")